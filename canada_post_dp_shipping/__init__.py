@@ -5,7 +5,9 @@ load_once('canada_post_dp_shipping', 'canada_post_dp_shipping')
 
 def get_methods():
     import shipper
-    return [shipper.Shipper(service_type=value)
+    # all the services share the packing and GetRates calls for the cart
+    rating = shipper.RatingContext()
+    return [shipper.Shipper(service_type=value, rating=rating)
             for value in config_choice_values('canada_post_dp_shipping',
                                               'SHIPPING_CHOICES')]
 
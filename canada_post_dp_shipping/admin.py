@@ -6,15 +6,16 @@ from django.core.files.base import File
 import os
 import tempfile
 import zipfile
+from canada_post_dp_shipping.errors import CircuitOpenError
 from canada_post_dp_shipping.utils import (get_origin, get_destination,
-                                           canada_post_api_kwargs, time_f)
+                                           canada_post_api_kwargs,
+                                           canada_post_api, api_call)
 from django.shortcuts import get_object_or_404, render
 from django.utils.translation import ugettext_lazy as _, ungettext_lazy
 from django.contrib.admin.sites import site
 from django.contrib import admin, messages
 from django.http import (HttpResponseRedirect, HttpResponse)
 
-from canada_post.api import CanadaPostAPI
 from canada_post_dp_shipping.models import (Box, OrderShippingService,
                                             ParcelDescription, ShipmentLink,
                                             Shipment, Manifest, ManifestLink)
@@ -60,9 +61,10 @@ class OrderShippingAdmin(admin.ModelAdmin):
     """
     fields = ['order', 'code']
     inlines = [ParcelInline]
-    readonly_fields = ['order', 'transmitted']
+    readonly_fields = ['order', 'transmitted', 'estimated']
     list_display = ['__unicode__', 'order', 'code', 'parcel_count',
-                    'shipments_created', 'has_labels', 'transmitted']
+                    'shipments_created', 'has_labels', 'transmitted',
+                    'estimated']
     actions = [
         'void_shipments',
         'get_labels',
@@ -120,8 +122,7 @@ class OrderShippingAdmin(admin.ModelAdmin):
             log.debug("POST with value=yes")
             # else method is POST
             shop_details = Config.objects.get_current()
-            cpa_kwargs = canada_post_api_kwargs(self.settings)
-            cpa = CanadaPostAPI(**cpa_kwargs)
+            cpa = canada_post_api(self.settings)
             origin = get_origin(shop_details)
 
             destination = get_destination(order_shipping.order.contact)
@@ -142,13 +143,22 @@ class OrderShippingAdmin(admin.ModelAdmin):
                         exs += 1
                 except Shipment.DoesNotExist:
                     log.debug("Creating shipment")
-                    cpa_ship = time_f(
-                        cpa.create_shipment,
-                        'canada-post-dp-shipping.create-shipping',
-                        parcel=parcel.get_parcel(), origin=origin,
-                        destination=destination,
-                        service=order_shipping.get_service(), group=group,
-                        options=options)
+                    try:
+                        cpa_ship = api_call(
+                            cpa.create_shipment,
+                            'canada-post-dp-shipping.create-shipping',
+                            parcel=parcel.get_parcel(), origin=origin,
+                            destination=destination,
+                            service=order_shipping.get_service(), group=group,
+                            options=options)
+                    except CircuitOpenError, e:
+                        log.warn("Not creating shipments: %s", e)
+                        messages.error(request, _(u"Canada Post is not "
+                                                  u"responding, {count} "
+                                                  u"shipments created. Please "
+                                                  u"try again in a couple of "
+                                                  u"minutes").format(count=cnt))
+                        return HttpResponseRedirect("..")
                     shipment = Shipment(shipment=cpa_ship, parcel=parcel)
                     shipment.save()
                     log.debug("Shipment created: %s", shipment)
@@ -220,6 +230,14 @@ class OrderShippingAdmin(admin.ModelAdmin):
                                                 "please wait a couple of "
                                                 "minutes and try again").format(
                                 id=shipment.id))
+                        except CircuitOpenError, e:
+                            log.warn("Not downloading label: %s", e)
+                            messages.error(request, _(
+                                "Failed downloading label for shipment {id} "
+                                "because Canada Post is not responding, "
+                                "please wait a couple of minutes and try "
+                                "again").format(id=shipment.id))
+                            continue
                     files.append(shipment.label.file)
                     log.debug("Got file (%d)", len(files))
             except Shipment.DoesNotExist:
@@ -261,8 +279,7 @@ class OrderShippingAdmin(admin.ModelAdmin):
             else:
                 queryset = queryset.select_related()
 
-        cpa_kwargs = canada_post_api_kwargs(self.settings)
-        cpa = CanadaPostAPI(**cpa_kwargs)
+        cpa = canada_post_api(self.settings)
         errcnt = 0
         gdcnt = 0
         dne = 0
@@ -274,9 +291,9 @@ class OrderShippingAdmin(admin.ModelAdmin):
                     shipment = parcel.shipment
                     log.debug("Got shipment %s", shipment)
                     cpa_shipment = shipment.get_shipment()
-                    if not time_f(cpa.void_shipment,
-                                  'canada-post-dp-shipping.void-shipment',
-                                  cpa_shipment):
+                    if not api_call(cpa.void_shipment,
+                                    'canada-post-dp-shipping.void-shipment',
+                                    cpa_shipment):
                         log.warn("Problem voiding shipment: %s", cpa_shipment)
                         errcnt += 1
                         self.message_user(request, _("Could not void shipment "
@@ -290,6 +307,9 @@ class OrderShippingAdmin(admin.ModelAdmin):
                 except Shipment.DoesNotExist:
                     log.debug("Shipment does not exist!")
                     dne += 1
+                except CircuitOpenError, e:
+                    log.warn("Not voiding shipment: %s", e)
+                    errcnt += 1
 
         if not errcnt:
             log.info("All shipments voided")
@@ -318,7 +338,12 @@ class OrderShippingAdmin(admin.ModelAdmin):
 
         send_msg = lambda message: self.message_user(request, message)
 
-        transmit_shipments(queryset, send_msg=send_msg)
+        try:
+            transmit_shipments(queryset, send_msg=send_msg)
+        except CircuitOpenError, e:
+            log.warn("Not transmitting shipments: %s", e)
+            messages.error(request, _("Canada Post is not responding, please "
+                                      "try again in a couple of minutes"))
 
     transmit_shipments.short_description = _("Transmit shipments for the "
                                              "selected orders")
@@ -2,6 +2,7 @@
 """
 Canada Post Developer Program Shipping Module
 """
+from decimal import Decimal
 from django.utils.translation import ugettext_lazy as _
 from livesettings import *
 
@@ -15,6 +16,30 @@ SHIPPING_GROUP = ConfigurationGroup('canada_post_dp_shipping',
                                     requiresvalue='canada_post_dp_shipping',
 )
 
+SERVICE_CHOICES = (
+    ('DOM.RP', u'Regular Parcel'),
+    ('DOM.EP', u'Expedited Parcel'),
+    ('DOM.XP', u'Xpresspost'),
+    ('DOM.XP.CERT', u'Xpresspost Certified'),
+    ('DOM.PC', u'Priority'),
+    ('DOM.LIB', u'Library Books'),
+    ('USA.EP', u'Expedited Parcel USA'),
+    ('USA.PW.ENV', u'Priority Worldwide Envelope USA'),
+    ('USA.PW.PAK', u'Priority Worldwide pak USA'),
+    ('USA.PW.PARCEL', u'Priority Worldwide Parcel USA'),
+    ('USA.SP.AIR', u'Small Packet USA Air'),
+    ('USA.SP.SURF', u'Small Packet USA Surface'),
+    ('USA.XP', u'Xpresspost USA'),
+    ('INT.XP', u'Xpresspost International'),
+    ('INT.IP.AIR', u'International Parcel Air'),
+    ('INT.IP.SURF', u'International Parcel Surface'),
+    ('INT.PW.ENV', u'Priority Worldwide Envelope Int’l'),
+    ('INT.PW.PAK', u'Priority Worldwide pak Int’l'),
+    ('INT.PW.PARCEL', u'Priority Worldwide parcel Int’l'),
+    ('INT.SP.AIR', u'Small Packet International Air'),
+    ('INT.SP.SURF', u'Small Packet International Surface'),
+)
+
 # values that are needed for later use
 ContractShipping = BooleanValue(SHIPPING_GROUP,
                                 'CONTRACT_SHIPPING',
@@ -73,9 +98,190 @@ config_register_list(
                          description=_("Packing iterations"),
                          help_text=_("If the parcels calculations take too "
                                      "long for orders with a large number of "
-                                     "items, try making this smaller"),
+                                     "items, try making this smaller. The "
+                                     "simple engine counts the packings it "
+                                     "tries, branch and bound the boxes it "
+                                     "fills, each of them trying up to 200 "
+                                     "packings"),
+                         default=5000),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'PACKING_BUDGET',
+                         description=_("Packing time budget"),
+                         help_text=_("Milliseconds the search for the best "
+                                     "way to pack an order can take. The best "
+                                     "packing found by then is used. Use 0 to "
+                                     "only limit the packing iterations"),
+                         default=2000),
+
+    StringValue(SHIPPING_GROUP,
+                'PACKING_ENGINE',
+                description=_("Packing engine"),
+                help_text=_("How parcels are chosen. Branch and bound "
+                            "scales better with a large number of boxes"),
+                choices=(('simple', _('Orientation search per box')),
+                         ('bnb', _('Branch and bound over boxes'))),
+                default='simple'),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'PACKING_PROCESSES',
+                         description=_("Packing processes"),
+                         help_text=_("Search the ways of packing an order in "
+                                     "a pool of this many processes, forked "
+                                     "once and kept between checkouts. Use 0 "
+                                     "to search in the checkout's process. "
+                                     "Only used by the orientation search "
+                                     "engine"),
+                         default=0),
+
+    StringValue(SHIPPING_GROUP,
+                'PACKING_WORKER_ADDRESS',
+                description=_("Packing worker address"),
+                help_text=_("Unix socket path or host:port where the "
+                            "packing_worker command listens. Orders are "
+                            "packed there instead of in the web process. "
+                            "Leave empty to pack in the web process"),
+                default=''),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'PACKING_WORKER_TIMEOUT',
+                         description=_("Packing worker timeout"),
+                         help_text=_("Milliseconds to wait for the packing "
+                                     "worker before packing in the web "
+                                     "process"),
+                         default=3000),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'INCREMENTAL_PACKING_FILL',
+                         description=_("Incremental packing fill"),
+                         help_text=_("When a cart changes, the parcels of its "
+                                     "previous packing are reused, taking out "
+                                     "and adding packages, as long as they "
+                                     "stay at least this percent as full as "
+                                     "the last packing from scratch. "
+                                     "Otherwise, or after a few repackings "
+                                     "in a row, the cart is packed again "
+                                     "from scratch. Use 0 to always pack "
+                                     "from scratch"),
+                         default=90),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'PACKING_BUNDLE_SIZE',
+                         description=_("Packing bundle size"),
+                         help_text=_("Identical items of a line are stacked "
+                                     "in bundles of up to this many items, "
+                                     "as long as the bundle fits in a box, "
+                                     "and packed as one. Makes packing bulk "
+                                     "orders much faster. Use 0 or 1 to pack "
+                                     "every item on its own"),
+                         default=0),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'RATES_POOL_SIZE',
+                         description=_("Concurrent GetRates calls"),
+                         help_text=_("How many GetRates calls can be issued "
+                                     "at the same time for orders that need "
+                                     "more than one parcel. Use 1 to call "
+                                     "Canada Post one parcel at a time"),
+                         default=4),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'RATES_SOFT_TTL',
+                         description=_("Rates freshness"),
+                         help_text=_("Seconds after which cached rates are "
+                                     "refreshed in the background. They are "
+                                     "still shown to the customer meanwhile"),
+                         default=60*60),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'RATES_HARD_TTL',
+                         description=_("Rates expiration"),
+                         help_text=_("Seconds after which cached rates are "
+                                     "discarded, and the customer has to wait "
+                                     "for Canada Post to answer again"),
+                         default=24*60*60),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'RATES_ERROR_TTL',
+                         description=_("Rates error retry"),
+                         help_text=_("Seconds to wait before asking Canada "
+                                     "Post again for a route that failed. "
+                                     "Doubles with every consecutive failure"),
+                         default=30),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'RATES_ERROR_MAX_TTL',
+                         description=_("Rates error maximum retry"),
+                         help_text=_("Maximum seconds to wait before asking "
+                                     "Canada Post again for a route that "
+                                     "keeps failing"),
+                         default=15*60),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'RATES_ERROR_PERMANENT_TTL',
+                         description=_("Rates permanent error retry"),
+                         help_text=_("Seconds to wait before asking Canada "
+                                     "Post again for a parcel it can't ship "
+                                     "(e.g. too large)"),
+                         default=24*60*60),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'BREAKER_FAILURE_RATE',
+                         description=_("Circuit breaker failure rate"),
+                         help_text=_("Percentage of failed or slow Canada "
+                                     "Post calls in the last minute that stops "
+                                     "calling it for a while. Use 0 to always "
+                                     "call Canada Post"),
+                         default=50),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'BREAKER_LATENCY',
+                         description=_("Circuit breaker latency"),
+                         help_text=_("Canada Post calls taking longer than "
+                                     "this many milliseconds count as failed. "
+                                     "Use 0 to only count errors"),
                          default=5000),
 
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'BREAKER_COOLDOWN',
+                         description=_("Circuit breaker cooldown"),
+                         help_text=_("Seconds to stop calling Canada Post for "
+                                     "once it's failing"),
+                         default=30),
+
+    PositiveIntegerValue(SHIPPING_GROUP,
+                         'CHECKOUT_DEADLINE',
+                         description=_("Checkout deadline"),
+                         help_text=_("Milliseconds the shipping calculation "
+                                     "can take in the checkout. After that "
+                                     "the best packing found so far is used, "
+                                     "and rates Canada Post didn't answer yet "
+                                     "are estimated from recent quotes. "
+                                     "Orders are always quoted in full. Use 0 "
+                                     "for no limit"),
+                         default=10000),
+
+    DecimalValue(SHIPPING_GROUP,
+                 'WEIGHT_INCREMENT',
+                 description=_("Weight increment"),
+                 help_text=_("Parcel weights are rounded up to a multiple of "
+                             "this many kilograms before asking for rates, so "
+                             "parcels Canada Post charges the same share "
+                             "cached rates. Use 0 to use the exact weight"),
+                 default=Decimal("0.1")),
+
+    MultipleStringValue(SHIPPING_GROUP,
+                        'FSA_SERVICES',
+                        description=_("Regional rates services"),
+                        help_text=_("Services whose price only depends on the "
+                                    "destination region (the first three "
+                                    "characters of the postal code). When all "
+                                    "the enabled services are regional, rates "
+                                    "are cached per region instead of per "
+                                    "postal code"),
+                        choices=SERVICE_CHOICES,
+                        default=()),
+
     ContractShipping,
 
     StringValue(SHIPPING_GROUP,
@@ -89,29 +295,7 @@ config_register_list(
     MultipleStringValue(SHIPPING_GROUP,
                         'SHIPPING_CHOICES',
                         description=_("Canada Post shipping choices available to customers."),
-                        choices = (
-                            ('DOM.RP', u'Regular Parcel'),
-                            ('DOM.EP', u'Expedited Parcel'),
-                            ('DOM.XP', u'Xpresspost'),
-                            ('DOM.XP.CERT', u'Xpresspost Certified'),
-                            ('DOM.PC', u'Priority'),
-                            ('DOM.LIB', u'Library Books'),
-                            ('USA.EP', u'Expedited Parcel USA'),
-                            ('USA.PW.ENV', u'Priority Worldwide Envelope USA'),
-                            ('USA.PW.PAK', u'Priority Worldwide pak USA'),
-                            ('USA.PW.PARCEL', u'Priority Worldwide Parcel USA'),
-                            ('USA.SP.AIR', u'Small Packet USA Air'),
-                            ('USA.SP.SURF', u'Small Packet USA Surface'),
-                            ('USA.XP', u'Xpresspost USA'),
-                            ('INT.XP', u'Xpresspost International'),
-                            ('INT.IP.AIR', u'International Parcel Air'),
-                            ('INT.IP.SURF', u'International Parcel Surface'),
-                            ('INT.PW.ENV', u'Priority Worldwide Envelope Int’l'),
-                            ('INT.PW.PAK', u'Priority Worldwide pak Int’l'),
-                            ('INT.PW.PARCEL', u'Priority Worldwide parcel Int’l'),
-                            ('INT.SP.AIR', u'Small Packet International Air'),
-                            ('INT.SP.SURF', u'Small Packet International Surface'),
-                            ),
+                        choices=SERVICE_CHOICES,
                         default = ('DOM.EP', 'DOM.XP', 'DOM.XP.CERT',
                                    'DOM.PC',)),
 
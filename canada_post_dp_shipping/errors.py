@@ -2,4 +2,16 @@ class ParcelDimensionError(Exception):
     """
     Exception raised when the parcel created is too large for Canada Post
     shipping. This can be activated and deactivated from livesettings
-    """
\ No newline at end of file
+    """
+
+class CircuitOpenError(Exception):
+    """
+    Exception raised instead of calling Canada Post while the circuit breaker
+    is open
+    """
+
+class PackingWorkerError(Exception):
+    """
+    Exception raised when the packing worker can't be reached or doesn't
+    answer in time, so that the packing is done in process instead
+    """
@@ -0,0 +1,27 @@
+"""
+Runs the packing worker, which packs the orders of the web workers when the
+PACKING_WORKER_ADDRESS setting is set
+"""
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from canada_post_dp_shipping.shipper import Shipper, PACKING_ENGINES
+from canada_post_dp_shipping.utils.worker import PackingWorker
+
+class Command(BaseCommand):
+    help = ("Packs orders for the web workers, keeping the latest packings "
+            "in memory")
+    option_list = BaseCommand.option_list + (
+        make_option('--address', default=None,
+                    help="Unix socket path or host:port to listen on. "
+                         "Defaults to the PACKING_WORKER_ADDRESS setting"),
+    )
+
+    def handle(self, *args, **options):
+        address = (options['address'] or
+                   Shipper().settings.PACKING_WORKER_ADDRESS.value)
+        if not address:
+            raise CommandError("Set PACKING_WORKER_ADDRESS or use --address")
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write(u"Packing worker listening on {}\n"
+                              .format(address))
+        PackingWorker(address, PACKING_ENGINES).serve()
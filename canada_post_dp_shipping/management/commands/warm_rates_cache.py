@@ -0,0 +1,93 @@
+"""
+Pre-fetches the rates of the most common parcels and destinations of past
+orders, so checkouts don't have to wait for Canada Post after the cache was
+emptied (e.g. after a deploy or a memcached restart)
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+from canada_post.util.address import Destination
+from canada_post.util.parcel import Parcel
+from django.core.management.base import BaseCommand
+from canada_post_dp_shipping.errors import ParcelDimensionError
+from canada_post_dp_shipping.models import ParcelDescription
+from canada_post_dp_shipping.shipper import Shipper
+from canada_post_dp_shipping.utils import (canada_post_api, get_origin,
+                                           normalize_postal_code)
+from canada_post_dp_shipping.utils.caching import get_stale
+from canada_post_dp_shipping.utils.http import get_session
+
+class Command(BaseCommand):
+    help = ("Fetches the rates of the most common (box, weight, destination "
+            "region) combinations of past orders into the rates cache")
+    option_list = BaseCommand.option_list + (
+        make_option('--budget', type='int', default=100,
+                    help="Maximum number of GetRates calls to make"),
+        make_option('--days', type='int', default=90,
+                    help="How many days of orders to look at"),
+        make_option('--pool', type='int', default=None,
+                    help="Concurrent GetRates calls. Defaults to the "
+                         "RATES_POOL_SIZE setting"),
+    )
+
+    def handle(self, *args, **options):
+        from satchmo_store.shop.models import Config
+        verbosity = int(options.get('verbosity', 1))
+        shipper = Shipper()
+        origin = get_origin(Config.objects.get_current())
+        cpa = canada_post_api(shipper.settings, production=True)
+
+        # count (box, weight, country, region), and remember the most common
+        #  postal code of each one to ask Canada Post with
+        combinations = Counter()
+        postal_codes = {}
+        since = datetime.now() - timedelta(days=options['days'])
+        descriptions = (ParcelDescription.objects
+                        .filter(shipping_detail__order__time_stamp__gte=since)
+                        .select_related('box', 'shipping_detail__order'))
+        for description in descriptions:
+            order = description.shipping_detail.order
+            postal_code = normalize_postal_code(order.ship_postal_code)
+            combination = (description.box,
+                           shipper.billed_weight(description.weight),
+                           order.ship_country, postal_code[:3])
+            combinations[combination] += 1
+            postal_codes.setdefault(combination, Counter())[postal_code] += 1
+
+        missing = {}
+        for combination, count in combinations.most_common():
+            if len(missing) >= options['budget']:
+                break
+            box, weight, country, region = combination
+            parcel = Parcel(length=box.length, width=box.width,
+                            height=box.height, weight=weight)
+            postal_code = postal_codes[combination].most_common(1)[0][0]
+            destination = Destination(postal_code=postal_code,
+                                      country_code=country)
+            cache_key = shipper.rates_cache_key(parcel, origin, destination)
+            parcel_services, is_stale = get_stale(cache_key)
+            if parcel_services is None or is_stale:
+                missing[cache_key] = (parcel, destination)
+
+        def fetch(item):
+            cache_key, (parcel, destination) = item
+            try:
+                shipper.fetch_rates(cpa, cache_key, parcel, origin,
+                                    destination)
+            except ParcelDimensionError:
+                pass
+            if verbosity > 1:
+                self.stdout.write(u"Fetched {}\n".format(cache_key))
+
+        pool_size = options['pool'] or shipper.settings.RATES_POOL_SIZE.value
+        # a connection for each call made at the same time
+        get_session(pool_size)
+        pool = ThreadPool(pool_size)
+        try:
+            pool.map(fetch, missing.items())
+        finally:
+            pool.close()
+        if verbosity > 0:
+            self.stdout.write(u"Fetched rates for {} of {} combinations\n"
+                              .format(len(missing), len(combinations)))
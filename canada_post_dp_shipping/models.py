@@ -3,13 +3,17 @@ Models for the canada post developer program's shipping method
 """
 from collections import Counter
 from django.conf import settings
+import logging
 from os import path
+import threading
+import time
 import requests
+from django.core.cache import cache
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
 from django.utils.translation import ugettext_lazy as _
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from canada_post.service import Service
 from canada_post.util.parcel import Parcel, Item
@@ -19,8 +23,11 @@ from jsonfield.fields import JSONField
 
 from satchmo_store.shop.models import Order, OrderCart
 from product.models import Product
-from canada_post_dp_shipping.utils import time_f
+from canada_post_dp_shipping.utils import api_call
+from canada_post_dp_shipping.utils.http import get_session
+from canada_post_dp_shipping.utils.package import Shape, expand
 
+log = logging.getLogger('canada_post_dp_shipping.models')
 
 class Box(models.Model):
     """
@@ -64,6 +71,144 @@ class Box(models.Model):
             setattr(self, attr, val)
             dims.remove(val)
 
+class BoxCatalog(object):
+    """
+    Process-local index of the boxes, so packing doesn't query them every
+    time. It's reloaded when the generation counter in the shared cache
+    changes, which happens whenever a Box is saved or deleted in any process
+    """
+    generation_key = 'CP-box-generation'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = None
+        self.boxes = []
+        self.box_packages = []
+        self.by_dimensions = {}
+
+    def current_generation(self):
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # use the time so a counter that was evicted doesn't come back
+            #  with an old value
+            cache.add(self.generation_key, int(time.time() * 1000))
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def load(self):
+        generation = self.current_generation()
+        if generation is not None and generation == self.generation:
+            return
+        with self.lock:
+            boxes = sorted(Box.objects.all(), key=lambda b: b.volume())
+            self.boxes = boxes
+            self.box_packages = [Shape.from_cm((b.length, b.width, b.height))
+                                 for b in boxes]
+            self.by_dimensions = dict(((b.length, b.width, b.height), b)
+                                      for b in boxes)
+            self.generation = generation
+
+    def invalidate(self):
+        self.generation = None
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            cache.set(self.generation_key, int(time.time() * 1000))
+
+    def packages(self):
+        """
+        A Shape for each box, smallest volume first
+        """
+        self.load()
+        return list(self.box_packages)
+
+    def get(self, length, width, height):
+        """
+        The box with these dimensions. Raises Box.DoesNotExist
+        """
+        self.load()
+        try:
+            return self.by_dimensions[(length, width, height)]
+        except KeyError:
+            return Box.objects.get(length=length, width=width, height=height)
+
+    def fitting(self, package):
+        """
+        The boxes the Shape package fits in, turned some way, smallest volume
+        first. Shapes keep their dimensions sorted, so comparing them as they
+        are is enough
+        """
+        self.load()
+        return [box for box, box_package in zip(self.boxes, self.box_packages)
+                if package in box_package]
+
+box_catalog = BoxCatalog()
+
+@receiver(post_save, sender=Box)
+@receiver(post_delete, sender=Box)
+def invalidate_box_catalog(sender, **kwargs):
+    box_catalog.invalidate()
+
+# attributes of the products needed for packing
+DIMENSIONS = ('length', 'width', 'height', 'weight')
+# seconds the dimensions of a product are cached
+DIMENSIONS_TTL = 5 * 60
+
+def dimensions_key(product_id):
+    return u"CP-dims-{}".format(product_id)
+
+def product_dimensions(products):
+    """
+    Returns {product.id: (length, width, height, weight)} like smart_attr()
+    would, with missing attributes of product variations taken from their
+    parent product. It makes at most one query for the whole list, and caches
+    the results for DIMENSIONS_TTL seconds
+    """
+    products = dict((p.id, p) for p in products)
+    cached = cache.get_many([dimensions_key(id) for id in products])
+    dimensions = {}
+    incomplete = []
+    for id, product in products.items():
+        if dimensions_key(id) in cached:
+            dimensions[id] = cached[dimensions_key(id)]
+        else:
+            values = tuple(getattr(product, attr) for attr in DIMENSIONS)
+            if any(v is None or v == "" for v in values):
+                incomplete.append(id)
+            dimensions[id] = values
+
+    if incomplete:
+        try:
+            from product.modules.configurable.models import ProductVariation
+        except ImportError:
+            ProductVariation = None
+        if ProductVariation is not None:
+            variations = (ProductVariation.objects.filter(product__in=incomplete)
+                          .select_related('parent__product'))
+            for variation in variations:
+                parent = variation.parent.product
+                dimensions[variation.product_id] = tuple(
+                    getattr(parent, attr) if value is None or value == ""
+                    else value for attr, value
+                    in zip(DIMENSIONS, dimensions[variation.product_id]))
+
+    cache.set_many(dict((dimensions_key(id), dimensions[id])
+                        for id in products
+                        if dimensions_key(id) not in cached), DIMENSIONS_TTL)
+    return dimensions
+
+@receiver(post_save, sender=Product)
+def invalidate_product_dimensions(sender, instance, **kwargs):
+    keys = [dimensions_key(instance.id)]
+    try:
+        from product.modules.configurable.models import ProductVariation
+        keys.extend(dimensions_key(id) for id in ProductVariation.objects
+                    .filter(parent__product=instance)
+                    .values_list('product_id', flat=True))
+    except ImportError:
+        pass
+    cache.delete_many(keys)
+
 class OrderShippingService(models.Model):
     """
     Save shipping details, such as link and product code
@@ -73,6 +218,11 @@ class OrderShippingService(models.Model):
                             help_text=_("Internal Canada Post product code"))
     transmitted = models.BooleanField(editable=False, default=False,
                                       verbose_name=_('transmitted'))
+    estimated = models.BooleanField(
+        editable=False, default=False, verbose_name=_('estimated'),
+        help_text=_("Some rates couldn't be quoted by Canada Post when the "
+                    "order was saved, and were estimated from recent quotes. "
+                    "Saving the order again quotes them again"))
     manifest = models.ForeignKey('canada_post_dp_shipping.Manifest',
                                  verbose_name=_('manifest'),
                                  null=True, editable=False)
@@ -143,10 +293,11 @@ class ParcelDescription(models.Model):
         if 'parcel' in kwargs:
             pass
         elif 'packs' in kwargs:
+            # PackageGroups, described one package at a time
             packs = kwargs.pop('packs')
             parcel = u"[{}]".format(u",".join(u"({})".format(unicode(p))
-                for p in packs))
-            weight = sum(p.weight for p in packs)
+                for p in expand(packs)))
+            weight = sum(p.kilograms for p in packs)
             kwargs.update({
                 'parcel': parcel,
                 'weight': weight,
@@ -179,11 +330,12 @@ class ParcelDescription(models.Model):
                 pos += 1
             return numbers
         ids = Counter(product_ids(self.parcel))
-        products = Product.objects.filter(id__in=ids)
+        products = list(Product.objects.filter(id__in=ids))
+        dimensions = product_dimensions(products)
         items = [Item(amount=ids[p.id],
                       description=getattr(settings, 'CANADA_POST_DESCRIPTION',
                                                     'goods'),
-                      weight=p.smart_attr('weight'), price=p.unit_price)
+                      weight=dimensions[p.id][3], price=p.unit_price)
                  for p in products]
         return Parcel(length=self.box.length, width=self.box.width,
                       height=self.box.height, weight=self.weight, items=items)
@@ -221,8 +373,8 @@ class Shipment(models.Model):
 
     def download_label(self, username, password):
         link = self.shipmentlink_set.get(type='label')
-        res = time_f(requests.get, 'canada-post-dp-shipping.get-label',
-                     link.data['href'], auth=(username, password))
+        res = api_call(get_session().get, 'canada-post-dp-shipping.get-label',
+                       link.data['href'], auth=(username, password))
         if res.status_code == 202:
             raise Shipment.Wait
         if not res.ok:
@@ -378,14 +530,17 @@ def create_shipping_details(sender, instance, **kwargs):
         shipping_detail.parceldescription_set.all().delete()
 
     shipper = shipping_method_by_key(order.shipping_model)
-    shipper.calculate(OrderCart(order), order.contact)
+    # the order gets every rate quoted, however long it takes
+    shipper.calculate(OrderCart(order), order.contact, checkout=False)
+    shipping_detail.estimated = shipper.estimated
+    if shipper.estimated:
+        log.warning(u"Order %s saved with estimated shipping rates", order.id)
 
     for service, parcel, packs in shipper.services:
         # these will be the same every time, but whatever
         shipping_detail.code = service.code
 
-        box = Box.objects.get(length=parcel.length, width=parcel.width,
-                              height=parcel.height)
+        box = box_catalog.get(parcel.length, parcel.width, parcel.height)
         parcel_description = ParcelDescription(
             shipping_detail=shipping_detail, box=box, packs=packs)
         parcel_description.save()
@@ -6,33 +6,89 @@ This dummy module can be used as a basis for creating your own
 """
 
 # Note, make sure you use decimal math everywhere!
+from copy import copy
 from decimal import Decimal
 from itertools import product
 import logging
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from canada_post.errors import CanadaPostError
-from canada_post_dp_shipping.errors import ParcelDimensionError
+from canada_post_dp_shipping.errors import (ParcelDimensionError,
+                                            CircuitOpenError,
+                                            PackingWorkerError)
 from canada_post_dp_shipping.utils import (get_origin, get_destination,
-                                           canada_post_api_kwargs)
+                                           canada_post_api)
 from django.core.cache import cache
 from django.utils.translation import ugettext as _
-from livesettings.functions import config_get_group
+from livesettings.functions import config_get_group, config_choice_values
 from shipping.modules.base import BaseShipper
 from satchmo_store.mail import send_store_mail
 
-from canada_post.api import CanadaPostAPI
 from canada_post.util.parcel import Parcel
-from canada_post_dp_shipping.models import Box
-from canada_post_dp_shipping.utils import time_f
-from canada_post_dp_shipping.utils.binpack_simple import binpack
-from canada_post_dp_shipping.utils.package import Package
+from canada_post_dp_shipping.models import box_catalog, product_dimensions
+from canada_post_dp_shipping.utils import (time_f, api_call, incr,
+                                           normalize_postal_code, round_weight)
+from canada_post_dp_shipping.utils.caching import (single_flight, set_stale,
+                                                   get_stale, unwrap_stale,
+                                                   WAIT)
+from canada_post_dp_shipping.utils.deadline import Deadline
+from canada_post_dp_shipping.utils import repacking, worker
+from canada_post_dp_shipping import tasks
+from canada_post_dp_shipping.utils import binpack_simple, binpack_bnb
+from canada_post_dp_shipping.utils.package import (Shape, PackageGroup, bundle,
+                                                   unbundle)
+from canada_post_dp_shipping.utils.packing import (packing_key, to_assignment,
+                                                   from_assignment)
 
 log = logging.getLogger('canada-post-dev-program.shipper')
 
+# a stale rate is refreshed at most once in this many seconds
+REFRESH_LOCK_TIMEOUT = 60
+# GetRates errors that won't go away by asking again
+#  9111: parcel too large
+PERMANENT_RATES_ERRORS = (9111,)
+# weight band (in kg) of the recent quotes used to estimate missing rates
+ESTIMATE_WEIGHT_BAND = Decimal("0.5")
+# how many recent quotes to keep for each service and weight band
+ESTIMATE_QUOTES = 5
+# how long the last packing of a cart is kept to repack it from when it changes
+CART_PACKING_TTL = 24 * 3600
+# seconds the packing worker is given past the packing deadline, to send back
+#  the packing it stopped at
+WORKER_DEADLINE_MARGIN = 0.2
+# the packing engines, by their PACKING_ENGINE setting value
+PACKING_ENGINES = {
+    'simple': binpack_simple.binpack,
+    'bnb': binpack_bnb.binpack,
+}
+
+class RatingContext(object):
+    """
+    Holds the service-independent part of a rating (the packing and the
+    GetRates answers for each parcel) so that all the Shippers built for the
+    same cart can share it instead of computing it once per service
+    """
+    def __init__(self):
+        self.key = None
+        self.result = None
+
+    def get(self, key, fun, *args, **kwargs):
+        """
+        Return the result of fun(*args, **kwargs), computing it only if key
+        is not the one of the last computed result
+        """
+        if self.key is None or self.key != key:
+            self.result = fun(*args, **kwargs)
+            self.key = key
+        return self.result
+
 class Shipper(BaseShipper):
 
-    def __init__(self, cart=None, contact=None, service_type=None):
+    def __init__(self, cart=None, contact=None, service_type=None,
+                 rating=None):
         """
-        Initialize a Shipper for a given service type
+        Initialize a Shipper for a given service type. Shippers sharing a
+        RatingContext will only pack and call GetRates once per cart
         """
         if service_type:
             self.service_code, self.service_text = service_type
@@ -41,6 +97,9 @@ class Shipper(BaseShipper):
             self.service_text = "Uninitialized"
         self.id = "canadapost-dp-{}".format(self.service_code)
         self.settings = config_get_group('canada_post_dp_shipping')
+        self.rating = rating or RatingContext()
+        # whether some of the rates are estimates, and should be quoted again
+        self.estimated = False
         super(Shipper, self).__init__(cart=cart, contact=contact)
 
     def __unicode__(self):
@@ -88,37 +147,87 @@ class Shipper(BaseShipper):
         """
         return self.is_valid
 
-    def calculate(self, cart, contact):
+    def calculate(self, cart, contact, checkout=True):
         """
         Here we decide for a packaging solution, generate a call to GetRates and
         cache it, and calculate the cost and transit of the current service, if
         available
+
+        In the checkout, the calculation is bounded by CHECKOUT_DEADLINE and
+        rates Canada Post doesn't answer in time are estimated. Otherwise (an
+        order being saved) it takes as long as it needs, and only estimates
+        rates while the circuit breaker is open; self.estimated tells
         """
         log.debug('Start Canada Post Dev Prog calculation')
 
         verbose = self.settings.VERBOSE_LOG.value
 
         self.transit_time = None # unknown transit time, as yet
+        if checkout:
+            deadline = Deadline(self.settings.CHECKOUT_DEADLINE.value)
+        else:
+            deadline = None
         self.is_valid, self.charges, self.services = time_f(
             self.get_rates, 'canada-post-dp-shipping.get-rates.all',
-            cart, contact)
+            cart, contact, deadline)
         if self.services:
             self.transit_time = max(s.transit_time for s, p, d in self.services)
+        self.estimated = any(getattr(s, 'estimated', False)
+                             for s, p, d in self.services)
+        if self.estimated:
+            log.warning(u"Using estimated rates for %s", self.service_code)
         self._calculated = True
 
-    def get_rates(self, cart, contact):
-        from satchmo_store.shop.models import Config
+    def rating_key(self, cart, contact):
+        """
+        Everything the service-independent rating depends on
+        """
+        address = contact.shipping_address
+        items = tuple((amt, item.id)
+                      for amt, item in cart.get_shipment_by_amount())
+        return items, address.postal_code, address.country_id
+
+    def get_rates(self, cart, contact, deadline=None):
         error_ret = False, None, []
+
+        # the rates of a checkout may be estimates, an order can't reuse them
+        parcel_rates = self.rating.get((self.rating_key(cart, contact),
+                                        deadline is None),
+                                       self.get_parcel_rates, cart, contact,
+                                       deadline)
+
+        services = []
+        for parcel, packs, parcel_services in parcel_rates:
+            # so services is [(Service, parcel, [packs]),...]
+            services.extend(product(filter(lambda s: s.code == self.service_code,
+                                      parcel_services), [parcel], [packs]))
+
+        if len(services) != len(parcel_rates):
+            # Not all parcels can be sent through this service
+            return error_ret
+        cost = Decimal("0.00")
+        for service, parcel, packs in services:
+            cost += service.price.total
+        return True, cost, services
+
+    def get_parcel_rates(self, cart, contact, deadline=None):
+        """
+        Packs the cart and gets the rates of every service for each parcel.
+        Rates that can't be fetched before the deadline are estimated.
+
+        Returns a list of (parcel, packs, [Service, ...])
+        """
+        if deadline is None:
+            deadline = Deadline()
+        from satchmo_store.shop.models import Config
         shop_details = Config.objects.get_current()
 
         # always use production api keys for get_rates, you don't get charged
         #  anyways
-        cpa_kwargs = canada_post_api_kwargs(self.settings, production=True)
-
-        cpa = CanadaPostAPI(**cpa_kwargs)
+        cpa = canada_post_api(self.settings, production=True)
 
         # parcels is a list of (Parcel, pack(dimensions))
-        parcels, rest = self.make_parcels(cart)
+        parcels, rest = self.make_parcels(cart, deadline)
         if rest:
             from django.contrib.sites.models import Site
             site = Site.objects.get_current()
@@ -136,48 +245,243 @@ class Shipper(BaseShipper):
         origin = get_origin(shop_details)
         destination = get_destination(contact)
 
-        services = []
-        for parcel, packs in parcels:
-            # rates depend on dimensions + origin + destination only
-            cache_key = "CP-GetRates-{W}-{l}x{w}x{h}-{fr}-{to}".format(
-                W=parcel.weight, w=parcel.width, h=parcel.height, l=parcel.length,
-                fr=origin.postal_code, to=destination.postal_code
-            )
-            parcel_services = cache.get(cache_key)
-            if parcel_services is None:
+        # rates depend on dimensions + origin + destination only, so identical
+        #  parcels share the same key
+        keys = [self.rates_cache_key(parcel, origin, destination)
+                for parcel, packs in parcels]
+        error_keys = [self.rates_error_key(key) for key in keys]
+        cached = cache.get_many(keys + error_keys)
+        rates = {}
+        stale = {}
+        missing = {}
+        misses = 0
+        for key, error_key, (parcel, packs) in zip(keys, error_keys, parcels):
+            value, is_stale = unwrap_stale(cached.get(key))
+            if value is None:
+                error = cached.get(error_key)
+                if error is None:
+                    missing[key] = parcel
+                    misses += 1
+                else:
+                    # this route failed recently, don't ask again yet
+                    rates[key] = self.rates_error(*error)
+            else:
+                rates[key] = value
+                if is_stale:
+                    stale[key] = parcel
+        incr('canada-post-dp-shipping.rates-cache.hit', len(parcels) - misses)
+        incr('canada-post-dp-shipping.rates-cache.miss', misses)
+        if stale:
+            # stale rates are still served, but refreshed in the background
+            self.refresh_rates(stale.items(), origin, destination)
+        if missing:
+            rates.update(self.fetch_all_rates(cpa, missing.items(), origin,
+                                              destination, deadline))
+        return [(parcel, packs, rates[key])
+                for key, (parcel, packs) in zip(keys, parcels)]
+
+    def rates_cache_key(self, parcel, origin, destination):
+        """
+        Parcels that Canada Post rates the same share the key: the weight is
+        rounded up to the billing increment, dimensions are rounded up to the
+        millimetre and sorted (30, 30.0 and 30.00 are all "30"), postal codes
+        are normalized, and canadian destinations are reduced to their region
+        (FSA) if all the enabled services are priced by region
+        """
+        to = normalize_postal_code(destination.postal_code)
+        if destination.country_code == 'CA' and self.regional_rates():
+            to = to[:3]
+        l, w, h = Shape.from_cm((parcel.length, parcel.width,
+                                 parcel.height)).to_cm()
+        return "CP-GetRates-{W}-{l}x{w}x{h}-{fr}-{cc}{to}".format(
+            W=self.billed_weight(parcel.weight), l=l, w=w, h=h,
+            fr=normalize_postal_code(origin.postal_code),
+            cc=destination.country_code, to=to
+        )
+
+    def regional_rates(self):
+        """
+        Whether all the enabled services are priced by destination region
+        """
+        codes = set(code for code, text in config_choice_values(
+            'canada_post_dp_shipping', 'SHIPPING_CHOICES'))
+        return codes <= set(self.settings.FSA_SERVICES.value)
+
+    def billed_weight(self, weight):
+        return round_weight(weight, self.settings.WEIGHT_INCREMENT.value)
+
+    def rates_error_key(self, cache_key):
+        return u"{}-error".format(cache_key)
+
+    def cached_rates(self, cache_key):
+        """
+        Returns the cached services for cache_key, or the error fallback if
+        the last call failed, or None if nothing is cached
+        """
+        parcel_services, is_stale = get_stale(cache_key)
+        if parcel_services is None:
+            error = cache.get(self.rates_error_key(cache_key))
+            if error is not None:
+                return self.rates_error(*error)
+        return parcel_services
+
+    def rates_error(self, code, message):
+        """
+        What GetRates errors turn into: a ParcelDimensionError for too large
+        parcels if RAISE_TOO_LARGE is set, or an empty services list
+        """
+        if self.settings.RAISE_TOO_LARGE.value and code == 9111:
+            raise ParcelDimensionError, message
+        return []
+
+    def rates_error_ttl(self, cache_key, code):
+        """
+        How long to remember a GetRates error: permanent errors are kept for
+        RATES_ERROR_PERMANENT_TTL, other errors for RATES_ERROR_TTL, doubling
+        for each consecutive failure up to RATES_ERROR_MAX_TTL
+        """
+        if code in PERMANENT_RATES_ERRORS:
+            return self.settings.RATES_ERROR_PERMANENT_TTL.value
+        strikes_key = u"{}-strikes".format(cache_key)
+        cache.add(strikes_key, 0, self.settings.RATES_HARD_TTL.value)
+        try:
+            strikes = cache.incr(strikes_key)
+        except ValueError:
+            # evicted in between
+            strikes = 1
+        return min(self.settings.RATES_ERROR_TTL.value * 2 ** (strikes - 1),
+                   self.settings.RATES_ERROR_MAX_TTL.value)
+
+    def fetch_all_rates(self, cpa, missing, origin, destination,
+                        deadline=None):
+        """
+        Calls GetRates for every (cache_key, parcel) in missing, issuing up to
+        RATES_POOL_SIZE calls at the same time. The rates that are not back
+        by the deadline are estimated. With a deadline the calls always run in
+        worker threads, even a single one, so that the deadline bounds them.
+
+        Returns a {cache_key: [Service, ...]} dict
+        """
+        if deadline is None:
+            deadline = Deadline()
+
+        def fetch(cache_key, parcel):
+            wait = WAIT
+            if deadline.remaining() is not None:
+                wait = min(wait, deadline.remaining())
+            # only one worker calls Canada Post for the same key at a time
+            return single_flight(
+                cache_key, lambda: self.cached_rates(cache_key),
+                lambda: self.fetch_rates(cpa, cache_key, parcel, origin,
+                                         destination), wait=wait)
+
+        rates = {}
+        pool_size = min(self.settings.RATES_POOL_SIZE.value, len(missing))
+        if pool_size < 2 and deadline.remaining() is None:
+            for cache_key, parcel in missing:
+                rates[cache_key] = fetch(cache_key, parcel)
+            return rates
+        if deadline.expired():
+            return dict((cache_key, self.estimate_rates(parcel))
+                        for cache_key, parcel in missing)
+        pool = ThreadPool(max(1, pool_size))
+        try:
+            results = [(cache_key, parcel,
+                        pool.apply_async(fetch, (cache_key, parcel)))
+                       for cache_key, parcel in missing]
+            for cache_key, parcel, result in results:
                 try:
-                    parcel_services = time_f(
-                        cpa.get_rates, 'canada-post-dp-shipping.get-rates',
-                        parcel, origin, destination)
-                except CanadaPostError, e:
-                    if self.settings.RAISE_TOO_LARGE.value and e.code == 9111:
-                        raise ParcelDimensionError, e.message
-                    else:
-                        log.error(u"Canada Post returned with error: %s|%s",
-                                  e.code, e.message)
-                    parcel_services = []
-                cache.set(cache_key, parcel_services)
+                    # exceptions raised in the workers (ParcelDimensionError)
+                    #  are re-raised here
+                    rates[cache_key] = result.get(deadline.remaining())
+                except TimeoutError:
+                    # the call goes on, and will cache its result for later
+                    rates[cache_key] = self.estimate_rates(parcel)
+            return rates
+        finally:
+            pool.close()
 
-            # so services is [(Service, parcel, [packs]),...]
-            services.extend(product(filter(lambda s: s.code == self.service_code,
-                                      parcel_services), [parcel], [packs]))
+    def estimate_key(self, code, weight):
+        return "CP-estimate-{code}-{band}".format(
+            code=code, band=int(weight / ESTIMATE_WEIGHT_BAND))
 
-        if len(services) != len(parcels):
-            # Not all parcels can be sent through this service
-            return error_ret
-        cost = Decimal("0.00")
-        for service, parcel, packs in services:
-            cost += service.price.total
-        return True, cost, services
+    def record_quotes(self, parcel, parcel_services):
+        """
+        Remember the latest quotes of each service for the parcel's weight
+        band, to estimate rates when Canada Post is too slow to answer
+        """
+        quotes = dict((self.estimate_key(s.code, parcel.weight), s)
+                      for s in parcel_services)
+        recent = cache.get_many(quotes.keys())
+        cache.set_many(dict(
+            (key, ([service] + recent.get(key, []))[:ESTIMATE_QUOTES])
+            for key, service in quotes.items()),
+                       self.settings.RATES_HARD_TTL.value)
+
+    def estimate_rates(self, parcel):
+        """
+        Estimates the rates of the enabled services for parcel from the most
+        expensive recent quote of its weight band. The estimated services are
+        flagged with an `estimated` attribute
+        """
+        log.warning(u"Estimating rates for %s", parcel)
+        keys = [self.estimate_key(code, parcel.weight)
+                for code, text in config_choice_values(
+                    'canada_post_dp_shipping', 'SHIPPING_CHOICES')]
+        services = []
+        for quotes in cache.get_many(keys).values():
+            service = copy(max(quotes, key=lambda s: s.price.total))
+            service.estimated = True
+            services.append(service)
+        return services
+
+    def refresh_rates(self, stale, origin, destination):
+        """
+        Queues a refresh of the [(cache_key, parcel), ...] whose rates are
+        stale, unless another process already did
+        """
+        stale = [(cache_key, parcel) for cache_key, parcel in stale
+                 if cache.add(u"{}-refresh".format(cache_key), True,
+                              REFRESH_LOCK_TIMEOUT)]
+        if stale:
+            log.debug("Refreshing stale rates: %s", [k for k, p in stale])
+            tasks.queue_refresh_rates(stale, origin, destination)
+
+    def fetch_rates(self, cpa, cache_key, parcel, origin, destination):
+        """
+        Calls GetRates for a single parcel and caches the result
+        """
+        # quote the weight the key was built with
+        quoted = copy(parcel)
+        quoted.weight = self.billed_weight(parcel.weight)
+        try:
+            parcel_services = api_call(
+                cpa.get_rates, 'canada-post-dp-shipping.get-rates',
+                quoted, origin, destination)
+        except CanadaPostError, e:
+            log.error(u"Canada Post returned with error: %s|%s",
+                      e.code, e.message)
+            # errors are cached apart, so they don't replace good rates that
+            #  may still be cached
+            cache.set(self.rates_error_key(cache_key), (e.code, e.message),
+                      self.rates_error_ttl(cache_key, e.code))
+            return self.rates_error(e.code, e.message)
+        except CircuitOpenError, e:
+            log.warning(u"Not calling GetRates: %s", e)
+            # serve whatever is still cached, without caching anything
+            return get_stale(cache_key)[0] or self.estimate_rates(parcel)
+        set_stale(cache_key, parcel_services, self.settings.RATES_SOFT_TTL.value,
+                  self.settings.RATES_HARD_TTL.value)
+        cache.delete(u"{}-strikes".format(cache_key))
+        self.record_quotes(parcel, parcel_services)
+        return parcel_services
 
-    def make_parcels(self, cart):
+    def make_parcels(self, cart, deadline=None):
         items = cart.get_shipment_by_amount()
+        dimensions = product_dimensions(item for amt, item in items)
         packages = []
         for amt, item in items:
-            length = item.smart_attr("length")
-            width = item.smart_attr("width")
-            height = item.smart_attr("height")
-            weight = item.smart_attr("weight")
+            length, width, height, weight = dimensions[item.id]
             if not all((length, width, height, weight)):
                 log.error(u"Dimensions error in item %s(#%d): (%s, %s, %s, %s)",
                           item, item.id, length, width, height, weight)
@@ -185,44 +489,148 @@ class Shipper(BaseShipper):
                                        u"({},{},{},{})").format(item, length,
                                                                width, height,
                                                                weight)
-            for _ in range(amt):
-                packages.append(Package((length, width, height), weight=weight, description=u"{}(#{})".format(item.name, item.id)))
+            # all the units of a line are packed as a group
+            packages.append(PackageGroup(
+                Shape.from_cm((length, width, height), weight=weight,
+                              description=u"{}(#{})".format(item.name, item.id)),
+                amt))
+
+        # no packing leaves out a package which fits in none of the boxes, and
+        #  the cart can't be sent at all, so there's no use looking for one
+        toobig = [g for g in packages if not box_catalog.fitting(g.package)]
+        if toobig:
+            return [], toobig
 
-        boxes = []
-        for box in Box.objects.all():
-            boxes.append(Package((box.length, box.width, box.height)))
+        boxes = box_catalog.packages()
 
-        packed, rest = self.binpack(packages, boxes)
+        # identical items go in stacks which are packed as one package
+        bundles = {}
+        bundle_size = self.settings.PACKING_BUNDLE_SIZE.value
+        if bundle_size > 1:
+            packages, bundles = bundle(packages, boxes, bundle_size)
+
+        packed, rest = self.binpack(packages, boxes, deadline,
+                                    self.cart_packing_key(cart))
+        if bundles:
+            packed = [([unbundle(pack, bundles) for pack in packs], bin)
+                      for packs, bin in packed]
+            rest = unbundle(rest, bundles)
         parcels = []
         if not rest:
             for packs, bin in packed:
+                length, width, height = bin.to_cm()
                 for pack in packs:
-                    weight = sum(p.weight for p in pack)
-                    parcels.append((Parcel(length = bin[0], width=bin[1],
-                                           height=bin[2], weight=weight),pack))
+                    weight = sum(g.kilograms for g in pack)
+                    parcels.append((Parcel(length=length, width=width,
+                                           height=height, weight=weight),pack))
         return parcels, rest
 
-    def binpack(self, packages, boxes):
-        def dims(packs):
-            """
-            Format Package list into shorter key for cache
-            :param packs: an iterable of
-                canada_post_dp_shipping.utils.package.Package
-            :return: a string
-            """
-            import hashlib
-            lines = [",".join((str(p.length), str(p.width), str(p.heigth), str(p.width))) for p in packs]
-            return hashlib.sha1("({})".format(",".join("({})".format(l) for l in lines))).hexdigest()
-        key = 'CP-binpack-p={}:b={}'.format(
-            dims(packages),
-            dims(boxes))
-        res = cache.get(key)
-        if res is not None:
-            #log.debug('return cached %s', str(res), extra={'cache-key': key})
+    def cart_packing_key(self, cart):
+        # orders are packed through a NullCart, which has no id
+        if getattr(cart, 'id', None) is None:
+            return None
+        return "CP-cart-packing-{}".format(cart.id)
+
+    def binpack(self, packages, boxes, deadline=None, cart_key=None):
+        # the cache only holds which shapes go in which box, the packages are
+        #  taken from this cart
+        engine = self.settings.PACKING_ENGINE.value
+        key = packing_key(packages, boxes, engine)
+        pack = PACKING_ENGINES.get(engine, binpack_simple.binpack)
+        # the fill of the last full packing of the cart and how many times it
+        #  was repacked since, when this packing is a repacking
+        repacked = {}
+
+        def lookup():
+            assignment = cache.get(key)
+            if assignment is None:
+                return None
             log.debug('return cached')
+            return from_assignment(assignment, packages, boxes)
+
+        def compute():
+            # the packing gets its own time budget, within the checkout's
+            budget = self.settings.PACKING_BUDGET.value
+            packing_deadline = (deadline or Deadline()).within(budget)
+            stats = {}
+            args = (packages, boxes, self.settings.PACKING_ITERATIONS.value,
+                    packing_deadline)
+            res = repack(packing_deadline)
+            if res is not None:
+                # not cached, the next cart with these contents gets a full
+                #  packing
+                incr('canada-post-dp-shipping.binpack.incremental')
+                log.debug('return repacked', extra={'cache-key': key})
+                return res
+            address = self.settings.PACKING_WORKER_ADDRESS.value
+            if address:
+                timeout = self.settings.PACKING_WORKER_TIMEOUT.value / 1000.0
+                remaining = packing_deadline.remaining()
+                if remaining is not None:
+                    # no use waiting for the worker past the deadline
+                    timeout = min(timeout, remaining + WORKER_DEADLINE_MARGIN)
+                try:
+                    res = time_f(worker.pack,
+                                 'canada-post-dp-shipping.binpack-worker',
+                                 address, timeout, engine, *args,
+                                 processes=self.settings.PACKING_PROCESSES.value,
+                                 stats=stats)
+                except PackingWorkerError, e:
+                    log.warning('packing in process: %s', e,
+                                extra={'cache-key': key})
+                    incr('canada-post-dp-shipping.binpack-worker.fallback')
+            if res is None:
+                res = time_f(pack, 'canada-post-dp-shipping.binpack', *args,
+                             stats=stats,
+                             processes=self.settings.PACKING_PROCESSES.value)
+            log.info('packing used %d of %s ms, cut short: %s',
+                     stats['elapsed'], budget or 'unlimited',
+                     stats['cut_short'], extra={'cache-key': key})
+            if stats.get('single_box'):
+                incr('canada-post-dp-shipping.binpack.single-box')
+            if stats.get('expired') or packing_deadline.expired():
+                # the search was stopped by the clock, don't keep this packing
+                log.debug('return partial', extra={'cache-key': key})
+                return res
+            cache.set(key, to_assignment(res))
+            #log.debug('return calculated %s', str(res), extra={'cache-key': key})
+            log.debug('return calculated', extra={'cache-key': key})
             return res
-        res = binpack(packages, boxes, self.settings.PACKING_ITERATIONS.value)
-        cache.set(key, res)
-        #log.debug('return calculated %s', str(res), extra={'cache-key': key})
-        log.debug('return calculated', extra={'cache-key': key})
+        def repack(packing_deadline):
+            # start from the packing of what the cart held before
+            fill = self.settings.INCREMENTAL_PACKING_FILL.value
+            previous = cache.get(cart_key) if cart_key and fill else None
+            # entries without the fill were stored before it was kept
+            if previous is None or len(previous) != 4 or previous[0] != engine:
+                return None
+            assignment, full_fill, repacks = previous[1:]
+            try:
+                assignment = time_f(
+                    repacking.repack, 'canada-post-dp-shipping.repack',
+                    assignment, packages, boxes,
+                    lambda groups: pack(groups, boxes,
+                                        self.settings.PACKING_ITERATIONS.value,
+                                        packing_deadline),
+                    fill / 100.0 * full_fill, repacks)
+                if assignment is None:
+                    return None
+                res = from_assignment(assignment, packages, boxes)
+                repacked.update(fill=full_fill, repacks=repacks + 1)
+                return res
+            except KeyError:
+                # the previous packing doesn't match this cart's packages
+                return None
+
+        # identical carts being packed at the same time are packed only once
+        res = single_flight(key, lookup, compute)
+        if cart_key:
+            # repackings are always compared to the last full packing, so
+            #  they can't drift further and further from it
+            assignment = to_assignment(res)
+            if repacked:
+                full_fill, repacks = repacked['fill'], repacked['repacks']
+            else:
+                full_fill, repacks = repacking.assignment_fill(assignment), 0
+            cache.set(cart_key, (engine, assignment, full_fill, repacks),
+                      CART_PACKING_TTL)
         return res
@@ -3,14 +3,14 @@ from django.contrib.sites.models import Site
 from django.core.files import File
 from django.template import Context
 from django.template.loader import get_template
-from canada_post.api import CanadaPostAPI
 from canada_post_dp_shipping.models import (Shipment, Manifest,
                                             OrderShippingService)
 from livesettings import config_get_group
-from canada_post_dp_shipping.utils import (canada_post_api_kwargs, get_origin,
-                                           time_f)
+from canada_post_dp_shipping.utils import (canada_post_api, get_origin,
+                                           api_call)
 from django.utils.translation import ungettext_lazy
 import os
+import threading
 from satchmo_store.mail import send_store_mail
 
 log = logging.getLogger('canada_post_dp_shipping.tasks')
@@ -19,26 +19,26 @@ USE_CELERY = False
 def get_manifests(links):
     log.info("Getting manifests from links: %s", links)
     settings = config_get_group('canada_post_dp_shipping')
-    cpa_kwargs = canada_post_api_kwargs(settings)
-    cpa = CanadaPostAPI(**cpa_kwargs)
+    cpa = canada_post_api(settings)
     manifests = []
     for link in links:
         log.debug("Getting manifest from %s", link['href'])
         try:
-            cpa_manifest = time_f(cpa.get_manifest,
-                                  'canada-post-dp-shipping.get-manifest', link)
+            cpa_manifest = api_call(cpa.get_manifest,
+                                    'canada-post-dp-shipping.get-manifest',
+                                    link)
             manifest = Manifest(manifest=cpa_manifest)
-            manifest_pdf = time_f(cpa.get_artifact,
-                                  'canada-post-dp-shipping.get-artifact',
-                                  cpa_manifest)
+            manifest_pdf = api_call(cpa.get_artifact,
+                                    'canada-post-dp-shipping.get-artifact',
+                                    cpa_manifest)
             filename = os.path.basename(link['href'].rstrip('/'))
             if not filename.endswith('.pdf'):
                 filename += '.pdf'
             manifest.artifact = File(manifest_pdf, filename)
             manifest.save()
-            shipments = time_f(cpa.get_manifest_shipments,
-                               'canada-post-dp-shipping.get-manifest-shipments',
-                               cpa_manifest)
+            shipments = api_call(cpa.get_manifest_shipments,
+                                 'canada-post-dp-shipping.get-manifest-shipments',
+                                 cpa_manifest)
             for shipment_id in shipments:
                 log.info("Setting manifest for shipment %s", shipment_id)
                 try:
@@ -76,8 +76,7 @@ def transmit_shipments(queryset=None, send_msg=None):
     from satchmo_store.shop.models import Config
     shop_details = Config.objects.get_current()
     settings = config_get_group('canada_post_dp_shipping')
-    cpa_kwargs = canada_post_api_kwargs(settings)
-    cpa = CanadaPostAPI(**cpa_kwargs)
+    cpa = canada_post_api(settings)
     origin = get_origin(shop_details)
 
     groups = []
@@ -96,9 +95,9 @@ def transmit_shipments(queryset=None, send_msg=None):
     log.debug("using groups: %s", groups)
     if groups:
         log.info("transmitting shipments")
-        links = time_f(cpa.transmit_shipments,
-                       'canada-post-dp-shipping.transmit-shipments',
-                       origin, groups)
+        links = api_call(cpa.transmit_shipments,
+                         'canada-post-dp-shipping.transmit-shipments',
+                         origin, groups)
         log.debug("received manifests: %s", links)
         log.debug("marking order shippings as transmitted")
         for order_shipping in order_shippings:
@@ -122,6 +121,35 @@ def transmit_shipments(queryset=None, send_msg=None):
         "Transmitted shipments for {count} groups".format(count=group_count),
         group_count))
 
+def refresh_rates(parcels, origin, destination):
+    """
+    Calls GetRates again for the [(cache_key, parcel), ...] whose cached rates
+    went stale, and caches the new ones
+    """
+    from canada_post_dp_shipping.shipper import Shipper
+    log.info("Refreshing rates: %s", [key for key, parcel in parcels])
+    shipper = Shipper()
+    cpa = canada_post_api(shipper.settings, production=True)
+    for cache_key, parcel in parcels:
+        try:
+            shipper.fetch_rates(cpa, cache_key, parcel, origin, destination)
+        except Exception, e:
+            log.error("Error refreshing rates for %s: %s", cache_key, e,
+                      exc_info=True)
+
+def queue_refresh_rates(parcels, origin, destination):
+    """
+    Runs refresh_rates out of the current request, in celery if available or
+    in a thread otherwise
+    """
+    if USE_CELERY:
+        refresh_rates_async.apply_async(args=(parcels, origin, destination))
+    else:
+        thread = threading.Thread(target=refresh_rates,
+                                  args=(parcels, origin, destination))
+        thread.daemon = True
+        thread.start()
+
 try:
     from celery.task import task
     @task
@@ -141,6 +169,10 @@ try:
     def transmit_shipments_async(*args, **kwargs):
         return transmit_shipments(*args, **kwargs)
 
+    @task
+    def refresh_rates_async(*args, **kwargs):
+        return refresh_rates(*args, **kwargs)
+
     USE_CELERY = True
 except ImportError, e:
     log.info("Not using celery: %s", e)
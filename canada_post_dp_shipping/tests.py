@@ -0,0 +1,459 @@
+"""
+Tests for the canada_post_dp_shipping app, run with
+`manage.py test canada_post_dp_shipping`.
+
+The helpers in utils that don't need django are tested by their doctests,
+which are gathered here too.
+"""
+from decimal import Decimal
+import doctest
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from canada_post.errors import CanadaPostError
+from canada_post.util.parcel import Parcel
+import requests
+from django.core.cache import cache
+from django.test import TestCase
+from livesettings.functions import config_get_group
+
+from canada_post_dp_shipping import tasks
+from canada_post_dp_shipping.errors import (CircuitOpenError,
+                                            PackingWorkerError)
+from canada_post_dp_shipping.shipper import Shipper, PACKING_ENGINES
+from canada_post_dp_shipping.utils import (binpack_bnb, binpack_simple, deadline,
+                                           package, packing, repacking, worker)
+from canada_post_dp_shipping.utils.http import (get_session, pool_library,
+                                                PooledRequests)
+from canada_post_dp_shipping.utils.package import PackageGroup, Shape, identity
+from canada_post_dp_shipping.utils.breaker import CircuitBreaker, MIN_CALLS
+from canada_post_dp_shipping.utils.caching import (single_flight, set_stale,
+                                                   get_stale)
+
+# modules whose doctests are part of the app's tests
+DOCTEST_MODULES = [binpack_simple, deadline, package, packing, repacking]
+
+def failing():
+    raise IOError("timed out")
+
+def rates_error(code):
+    # made without calling the constructor, so the tests don't depend on its
+    #  signature
+    error = CanadaPostError.__new__(CanadaPostError)
+    error.code, error.message = code, u"error {}".format(code)
+    return error
+
+class Quote(object):
+    code = 'DOM.EP'
+
+class StubAPI(object):
+    """
+    Stands for the Canada Post API, get_rates() gives the answers in turn,
+    raising those which are exceptions
+    """
+    def __init__(self, *answers):
+        self.answers = list(answers)
+
+    def get_rates(self, parcel, origin, destination):
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        settings = config_get_group('canada_post_dp_shipping')
+        settings.BREAKER_FAILURE_RATE.update(50)
+        settings.BREAKER_LATENCY.update(0)
+        settings.BREAKER_COOLDOWN.update(30)
+        self.breaker = CircuitBreaker('CP-test-breaker')
+
+    def tearDown(self):
+        cache.delete_many([self.breaker.open_key, self.breaker.probation_key,
+                           self.breaker.calls_key, self.breaker.failures_key])
+
+    def test_opens(self):
+        for i in range(MIN_CALLS):
+            self.assertFalse(self.breaker.is_open())
+            self.assertRaises(IOError, self.breaker.call, failing)
+        self.assertTrue(self.breaker.is_open())
+        self.assertRaises(CircuitOpenError, self.breaker.call, lambda: 1)
+
+    def test_stays_closed_below_the_failure_rate(self):
+        for i in range(MIN_CALLS):
+            self.assertEqual(self.breaker.call(lambda: 1), 1)
+        for i in range(MIN_CALLS - 1):
+            self.assertRaises(IOError, self.breaker.call, failing)
+        self.assertFalse(self.breaker.is_open())
+
+    def test_probation(self):
+        self.breaker.trip(config_get_group('canada_post_dp_shipping'))
+        # the cooldown is over, a single failure opens it again
+        cache.delete(self.breaker.open_key)
+        self.assertEqual(self.breaker.call(lambda: 1), 1)
+        self.assertRaises(IOError, self.breaker.call, failing)
+        self.assertTrue(self.breaker.is_open())
+
+    def test_disabled(self):
+        config_get_group('canada_post_dp_shipping').BREAKER_FAILURE_RATE.update(0)
+        for i in range(MIN_CALLS * 2):
+            self.assertRaises(IOError, self.breaker.call, failing)
+        self.assertFalse(self.breaker.is_open())
+
+class SingleFlightTest(TestCase):
+    key = 'CP-test-single-flight'
+    lock_key = u"{}-lock".format(key)
+
+    def tearDown(self):
+        cache.delete(self.lock_key)
+
+    def test_cached(self):
+        self.assertEqual(single_flight(self.key, lambda: 'cached', failing),
+                         'cached')
+
+    def test_computes_and_unlocks(self):
+        self.assertEqual(single_flight(self.key, lambda: None,
+                                       lambda: 'computed'), 'computed')
+        self.assertEqual(cache.get(self.lock_key), None)
+
+    def test_waits_for_the_lock_holder(self):
+        cache.add(self.lock_key, True, 30)
+        answers = [None, None, 'theirs']
+        self.assertEqual(single_flight(self.key, lambda: answers.pop(0),
+                                       failing), 'theirs')
+
+    def test_computes_when_the_holder_fails(self):
+        cache.add(self.lock_key, True, 30)
+        def lookup():
+            # the holder gave up without caching anything
+            cache.delete(self.lock_key)
+            return None
+        self.assertEqual(single_flight(self.key, lookup, lambda: 'mine'),
+                         'mine')
+
+    def test_stops_waiting(self):
+        cache.add(self.lock_key, True, 30)
+        self.assertEqual(single_flight(self.key, lambda: None,
+                                       lambda: 'mine', wait=0.2), 'mine')
+
+class Address(object):
+    def __init__(self, postal_code, country_code='CA'):
+        self.postal_code = postal_code
+        self.country_code = country_code
+
+class RatesCacheKeyTest(TestCase):
+    def setUp(self):
+        self.shipper = Shipper()
+
+    def key(self, length, width, height, weight=Decimal('1.25'),
+            destination='K1A 0B1'):
+        parcel = Parcel(length=length, width=width, height=height,
+                        weight=weight)
+        return self.shipper.rates_cache_key(parcel, Address('H2X 1Y4'),
+                                            Address(destination))
+
+    def test_dimensions(self):
+        # as Box fields and as packed by make_parcels()
+        self.assertEqual(
+            self.key(Decimal('30.0'), Decimal('20.0'), Decimal('10.0')),
+            self.key(Decimal('30'), Decimal('20'), Decimal('10')))
+        self.assertEqual(self.key(30, 20, 10), self.key(10, 30, 20))
+        self.assertNotEqual(self.key(Decimal('30.5'), 20, 10),
+                            self.key(30, 20, 10))
+
+    def test_weight(self):
+        self.assertEqual(self.key(30, 20, 10, Decimal('1.21')),
+                         self.key(30, 20, 10, Decimal('1.3')))
+        self.assertNotEqual(self.key(30, 20, 10, Decimal('1.3')),
+                            self.key(30, 20, 10, Decimal('1.31')))
+
+    def test_postal_code(self):
+        self.assertEqual(self.key(30, 20, 10, destination='k1a0b1'),
+                         self.key(30, 20, 10, destination='K1A 0B1'))
+
+class RatesErrorTest(TestCase):
+    key = 'CP-test-rates'
+
+    def setUp(self):
+        settings = config_get_group('canada_post_dp_shipping')
+        settings.BREAKER_FAILURE_RATE.update(0)
+        settings.RATES_ERROR_TTL.update(30)
+        settings.RATES_ERROR_MAX_TTL.update(100)
+        settings.RATES_ERROR_PERMANENT_TTL.update(1000)
+        self.shipper = Shipper()
+        self.ttls = []
+        rates_error_ttl = self.shipper.rates_error_ttl
+        def recorded_ttl(cache_key, code):
+            self.ttls.append(rates_error_ttl(cache_key, code))
+            return self.ttls[-1]
+        self.shipper.rates_error_ttl = recorded_ttl
+        self.parcel = Parcel(length=30, width=20, height=10,
+                             weight=Decimal('1.25'))
+
+    def tearDown(self):
+        cache.delete_many([self.key, self.shipper.rates_error_key(self.key),
+                           u"{}-strikes".format(self.key),
+                           self.shipper.estimate_key(Quote.code,
+                                                     self.parcel.weight)])
+
+    def fetch(self, *answers):
+        cpa = StubAPI(*answers)
+        for answer in answers:
+            self.shipper.fetch_rates(cpa, self.key, self.parcel,
+                                     Address('H2X 1Y4'), Address('K1A 0B1'))
+
+    def test_backoff(self):
+        self.fetch(*[rates_error(1000) for i in range(4)])
+        self.assertEqual(self.ttls, [30, 60, 100, 100])
+
+    def test_permanent(self):
+        self.fetch(rates_error(9111), rates_error(9111))
+        self.assertEqual(self.ttls, [1000, 1000])
+
+    def test_success_resets_the_backoff(self):
+        self.fetch(rates_error(1000), rates_error(1000), [], rates_error(1000))
+        self.assertEqual(self.ttls, [30, 60, 30])
+
+    def test_error_doesnt_hide_good_rates(self):
+        self.fetch([Quote()], rates_error(1000))
+        self.assertTrue(cache.get(self.shipper.rates_error_key(self.key)))
+        self.assertEqual([s.code for s in self.shipper.cached_rates(self.key)],
+                         [Quote.code])
+
+class StaleRatesTest(TestCase):
+    key = 'CP-test-stale-rates'
+
+    def setUp(self):
+        self.shipper = Shipper()
+        self.queued = []
+        self.queue_refresh_rates = tasks.queue_refresh_rates
+        tasks.queue_refresh_rates = lambda stale, origin, destination: \
+            self.queued.extend(stale)
+        self.parcel = Parcel(length=30, width=20, height=10,
+                             weight=Decimal('1.25'))
+
+    def tearDown(self):
+        tasks.queue_refresh_rates = self.queue_refresh_rates
+        cache.delete_many([self.key, u"{}-refresh".format(self.key),
+                           self.shipper.estimate_key(Quote.code,
+                                                     self.parcel.weight)])
+
+    def test_fresh(self):
+        settings = config_get_group('canada_post_dp_shipping')
+        settings.BREAKER_FAILURE_RATE.update(0)
+        settings.RATES_SOFT_TTL.update(60)
+        self.shipper.fetch_rates(StubAPI([Quote()]), self.key, self.parcel,
+                                 Address('H2X 1Y4'), Address('K1A 0B1'))
+        services, is_stale = get_stale(self.key)
+        self.assertEqual([s.code for s in services], [Quote.code])
+        self.assertFalse(is_stale)
+
+    def test_stale_is_served_and_refreshed_once(self):
+        set_stale(self.key, [Quote()], -1, 60)
+        services, is_stale = get_stale(self.key)
+        self.assertEqual(len(services), 1)
+        self.assertTrue(is_stale)
+        stale = [(self.key, self.parcel)]
+        self.shipper.refresh_rates(stale, None, None)
+        self.shipper.refresh_rates(stale, None, None)
+        self.assertEqual(self.queued, stale)
+
+    def test_hard_ttl(self):
+        set_stale(self.key, [Quote()], 0, 1)
+        time.sleep(1.1)
+        self.assertEqual(get_stale(self.key), (None, False))
+
+class CalculateTest(TestCase):
+    def test_orders_have_no_deadline(self):
+        shipper = Shipper(service_type=('DOM.EP', 'Expedited Parcel'))
+        deadlines = []
+        def get_parcel_rates(cart, contact, deadline=None):
+            deadlines.append(deadline)
+            return []
+        shipper.rating_key = lambda cart, contact: 'cart'
+        shipper.get_parcel_rates = get_parcel_rates
+        shipper.calculate(None, None)
+        shipper.calculate(None, None, checkout=False)
+        # the order doesn't reuse the checkout's rating, which may be estimated
+        self.assertEqual(len(deadlines), 2)
+        self.assertTrue(isinstance(deadlines[0], deadline.Deadline))
+        self.assertEqual(deadlines[1], None)
+
+class FetchAllRatesTest(TestCase):
+    def test_deadline_bounds_a_single_call(self):
+        shipper = Shipper()
+        shipper.cached_rates = lambda cache_key: None
+        shipper.fetch_rates = lambda *args: time.sleep(2)
+        shipper.estimate_rates = lambda parcel: 'estimated'
+        start = time.time()
+        rates = shipper.fetch_all_rates(None, [('CP-test-slow', None)], None,
+                                        None, deadline.Deadline(200))
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(rates, {'CP-test-slow': 'estimated'})
+
+class CartPackingKeyTest(TestCase):
+    def test_cart(self):
+        class Cart(object):
+            id = 5
+        self.assertEqual(Shipper().cart_packing_key(Cart()), "CP-cart-packing-5")
+
+    def test_no_cart(self):
+        self.assertEqual(Shipper().cart_packing_key(None), None)
+        # an order's NullCart has no id
+        self.assertEqual(Shipper().cart_packing_key(object()), None)
+
+class ProcessPoolTest(TestCase):
+    def test_resizing_keeps_the_pool_in_use(self):
+        pool = binpack_simple.get_pool(2)
+        try:
+            binpack_simple.release_pool(binpack_simple.get_pool(3))
+            self.assertEqual(pool.apply(abs, (-1,)), 1)
+        finally:
+            binpack_simple.release_pool(pool)
+
+    def test_finished_search_cant_publish(self):
+        pool = binpack_simple.get_pool(2)
+        try:
+            slot, generation = binpack_simple.take_slot(0)
+            old = dict(slot=slot, generation=generation, bincount=3)
+            binpack_simple.publish(old)
+            self.assertEqual(binpack_simple.published(old), 3)
+            binpack_simple._free_slots.put(slot)
+            # the slot goes back last, taking them all hands it out again
+            taken = [binpack_simple.take_slot(0)
+                     for i in range(binpack_simple.POOL_SLOTS)]
+            try:
+                new = dict(slot=slot, generation=dict(taken)[slot],
+                           bincount=5)
+                self.assertEqual(binpack_simple.published(old), 0)
+                binpack_simple.publish(old)
+                binpack_simple.publish(new)
+                self.assertEqual(binpack_simple.published(new), 5)
+            finally:
+                for slot, generation in taken:
+                    binpack_simple._free_slots.put(slot)
+        finally:
+            binpack_simple.release_pool(pool)
+
+class BranchAndBoundTest(TestCase):
+    def setUp(self):
+        self.groups = [PackageGroup(Shape((100 + 37 * i, 80 + 23 * i, 60 + 11 * i)),
+                                    1 + i % 4) for i in range(12)]
+        self.boxes = [Shape((150 + 13 * i, 200 + 11 * i, 100 + 9 * i))
+                      for i in range(40)]
+
+    def units(self, groups):
+        units = {}
+        for g in groups:
+            key = identity(g.package)
+            units[key] = units.get(key, 0) + g.count
+        return units
+
+    def check(self, iterlimit, budget=None):
+        stats = {}
+        start = time.time()
+        packed, rest = binpack_bnb.binpack(
+            self.groups, self.boxes, iterlimit,
+            deadline.Deadline(budget) if budget else None, stats)
+        self.assertEqual(
+            self.units([g for contents, box in packed for content in contents
+                        for g in content] + rest),
+            self.units(self.groups))
+        return time.time() - start, stats
+
+    def test_accounts_for_every_unit(self):
+        elapsed, stats = self.check(20)
+        self.assertTrue(stats['cut_short'])
+
+    def test_deadline(self):
+        elapsed, stats = self.check(5000, 100)
+        self.assertTrue(stats['cut_short'])
+        self.assertTrue(elapsed < 0.5)
+
+class PackingWorkerTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'worker')
+        self.groups = [PackageGroup(Shape((100, 200, 50), 300, 'a'), 4),
+                       PackageGroup(Shape((300, 100, 100), 200, 'b'), 2)]
+        self.boxes = [Shape((300, 200, 150)), Shape((600, 400, 400))]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def pack(self, timeout=5):
+        return worker.pack(self.address, timeout, 'simple', self.groups,
+                           self.boxes, 1000)
+
+    def test_packs(self):
+        thread = threading.Thread(target=worker.PackingWorker(
+            self.address, PACKING_ENGINES).serve)
+        thread.daemon = True
+        thread.start()
+        while not os.path.exists(self.address):
+            time.sleep(0.01)
+        # a client which doesn't even authenticate doesn't hold the others
+        silent = socket.socket(socket.AF_UNIX)
+        silent.connect(self.address)
+        try:
+            self.assertEqual(
+                packing.to_assignment(self.pack()),
+                packing.to_assignment(binpack_simple.binpack(
+                    self.groups, self.boxes, 1000)))
+        finally:
+            silent.close()
+
+    def test_no_worker(self):
+        self.assertRaises(PackingWorkerError, self.pack)
+
+    def test_silent_worker(self):
+        # accepts connections, but never answers
+        listener = socket.socket(socket.AF_UNIX)
+        listener.bind(self.address)
+        listener.listen(5)
+        try:
+            start = time.time()
+            self.assertRaises(PackingWorkerError, self.pack, 0.2)
+            self.assertTrue(time.time() - start < 2)
+        finally:
+            listener.close()
+
+class PooledSessionTest(TestCase):
+    def test_grows(self):
+        get_session(40)
+        get_session(2)
+        adapter = get_session().get_adapter('https://soa-gw.canadapost.ca/')
+        self.assertTrue(adapter._pool_maxsize >= 40)
+
+    def test_pool_library(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(directory, 'cp_pooling_test'))
+            for name in ('__init__', 'service'):
+                with open(os.path.join(directory, 'cp_pooling_test',
+                                       name + '.py'), 'w') as module:
+                    module.write("import requests\n")
+            sys.path.insert(0, directory)
+            try:
+                pool_library('cp_pooling_test')
+            finally:
+                sys.path.remove(directory)
+            from cp_pooling_test import service
+            self.assertTrue(isinstance(service.requests, PooledRequests))
+            self.assertTrue(service.requests.exceptions is
+                            requests.exceptions)
+        finally:
+            shutil.rmtree(directory)
+
+def suite():
+    tests = unittest.TestSuite()
+    for module in DOCTEST_MODULES:
+        tests.addTest(doctest.DocTestSuite(module))
+    tests.addTest(unittest.defaultTestLoader.loadTestsFromModule(
+        sys.modules[__name__]))
+    return tests
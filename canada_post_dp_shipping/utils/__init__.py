@@ -1,5 +1,10 @@
+from decimal import Decimal, ROUND_CEILING
+import threading
 from canada_post import PROD, DEV
+from canada_post.api import CanadaPostAPI
 from canada_post.util.address import Origin, Destination
+from canada_post_dp_shipping.utils.breaker import breaker
+from canada_post_dp_shipping.utils.http import get_session, pool_library
 from l10n.models import AdminArea
 import time
 try:
@@ -32,6 +37,24 @@ def get_destination(contact):
                        city=contact.shipping_address.city,
                        province=contact.shipping_address.state)
 
+def normalize_postal_code(postal_code):
+    """
+    Canonical form of a postal code: "h2x 1y4" -> "H2X1Y4"
+    """
+    return u"".join(c for c in postal_code or u"" if c.isalnum()).upper()
+
+def round_weight(weight, increment):
+    """
+    Rounds weight up to a multiple of increment
+
+    >>> round_weight(Decimal("1.201"), Decimal("0.1"))
+    Decimal('1.3')
+    """
+    if not increment:
+        return weight
+    weight = Decimal(str(weight))
+    return (weight / increment).to_integral_value(ROUND_CEILING) * increment
+
 def canada_post_api_kwargs(settings, production=None):
     cpa_kwargs = {
         'customer_number': settings.CUSTOMER_NUMBER.value
@@ -55,6 +78,37 @@ def canada_post_api_kwargs(settings, production=None):
         cpa_kwargs['contract_number'] = settings.CONTRACT_NUMBER.value
     return cpa_kwargs
 
+_apis = {}
+_apis_lock = threading.Lock()
+
+def canada_post_api(settings, production=None):
+    """
+    Returns the process-wide CanadaPostAPI for these settings. The
+    canada_post library calls requests on its own, so its modules are pointed
+    to the pooled session, which keeps a connection for each of the
+    RATES_POOL_SIZE concurrent calls
+    """
+    get_session(settings.RATES_POOL_SIZE.value)
+    pool_library('canada_post')
+    cpa_kwargs = canada_post_api_kwargs(settings, production)
+    key = repr(sorted(cpa_kwargs.items()))
+    with _apis_lock:
+        if key not in _apis:
+            _apis[key] = CanadaPostAPI(**cpa_kwargs)
+        return _apis[key]
+
+def incr(metric, count=1):
+    """
+    Counts events, in statsd if available or in the log otherwise
+    """
+    if not count:
+        return
+    if STATSD:
+        statsd.incr(metric, count)
+    else:
+        log = logging.getLogger(metric)
+        log.info('count: %d', count)
+
 def time_f(fun, metric, *args, **kwargs):
     start = time.time()
     ret = fun(*args, **kwargs)
@@ -65,3 +119,10 @@ def time_f(fun, metric, *args, **kwargs):
         log = logging.getLogger(metric)
         log.info('timing: %d', lapse)
     return ret
+
+def api_call(fun, metric, *args, **kwargs):
+    """
+    time_f for the calls to the Canada Post API, which go through the circuit
+    breaker. Raises CircuitOpenError without calling fun if it's open
+    """
+    return breaker.call(time_f, fun, metric, *args, **kwargs)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+binpack_bnb.py
+
+Branch and bound over box types.
+
+binpack_simple tries every box type for the whole order and recurses into the smaller boxes for
+whatever is left over, which gets slow as the box catalog grows. This engine builds the packing one
+box at a time instead: every box type is filled as well as it can be with the packages still to
+pack, and the search goes on depth first from the most promising fill. A branch is dropped as soon
+as what it costs so far, plus a lower bound on what the packages left will cost, can't beat the best
+packing found.
+
+Costs are those of binpack_simple.packing_cost, so both engines agree on which packing is best, and
+binpack() takes and returns the same things as binpack_simple.binpack().
+"""
+
+from __future__ import division
+
+import time
+
+
+from package import Package, PackageGroup, group, identity
+from binpack_simple import (Timeout, allpermutations, cheapest_single_box, fits, lower_bound,
+                            packing_cost, packit, unit_volume)
+
+
+# iterations of the orientation search used to fill a single box
+FILL_ITERATIONS = 200
+
+
+class BranchAndBound(object):
+    """Search state for packing groups into bins.
+
+    Nodes are the counts left of each group and the bins used so far. Every bin tried at a node
+    counts as an iteration, filling it again for the same counts is free, so iterlimit bounds the
+    bins filled where binpack_simple's bounds the packings tried. Each fill tries up to
+    FILL_ITERATIONS packings. With processes above 1 the orientations tried to fill a bin are
+    searched in binpack_simple's process pool.
+    """
+
+    def __init__(self, groups, bins, iterlimit, deadline=None, processes=0):
+        self.groups = groups
+        self.bins = bins
+        self.iterlimit = iterlimit
+        self.deadline = deadline
+        self.processes = processes
+        self.counter = 0
+        self.unit = getattr(bins[0], 'scale', 1) ** 3
+        # cost of using a bin type at all, the rest of its cost is the empty space
+        self.fixed = [packing_cost([], bin) for bin in bins]
+        self.fitting = [[ix for ix, bin in enumerate(bins) if fits(g.package, bin)]
+                        for g in groups]
+        self.smallest = [min(bins[ix].volume for ix in ixs) for ixs in self.fitting]
+        self.index = {}
+        for i, g in enumerate(groups):
+            self.index.setdefault(identity(g.package), []).append(i)
+        self.fills = {}
+        self.seen = {}
+        self.best = None
+        self.best_cost = None
+
+    def exhausted(self):
+        """Whether the search is out of iterations or time."""
+        return (self.counter >= self.iterlimit or
+                self.deadline is not None and self.deadline.expired())
+
+    def tick(self, strict=True):
+        self.counter += 1
+        if not strict:
+            return
+        if self.counter > self.iterlimit:
+            raise Timeout('more than %d iterations tries' % self.counter)
+        if self.deadline is not None and self.deadline.expired():
+            raise Timeout('deadline reached after %d iterations' % self.counter)
+
+    def fill(self, left, ix):
+        """The fullest single bin of type ix for the counts in left, and the counts left after it."""
+        key = (left, ix)
+        if key not in self.fills:
+            bin = self.bins[ix]
+            todo = [PackageGroup(g.package, n) for g, n in zip(self.groups, left) if n]
+            packs, rest = allpermutations(todo, bin, FILL_ITERATIONS, self.deadline,
+                                          bound=lower_bound(todo, bin),
+                                          processes=self.processes)
+            content = max(packs, key=lambda pack: sum(g.volume for g in pack)) if packs else []
+            self.fills[key] = content, self.take(left, content)
+        return self.fills[key]
+
+    def take(self, left, content):
+        """The counts left once the PackageGroups in content are packed."""
+        after = list(left)
+        for g in content:
+            count = g.count
+            for i in self.index[identity(g.package)]:
+                n = min(count, after[i])
+                after[i] -= n
+                count -= n
+        return tuple(after)
+
+    def greedy(self, left, used, cost):
+        """The largest bin any package left fits in, filled by a single packit(), as children()
+        returns it. This is what the dive falls back to once out of iterations or time."""
+        fitting = set(ix for i, n in enumerate(left) if n for ix in self.fitting[i])
+        ix = max(fitting, key=lambda ix: self.bins[ix].volume)
+        bin = self.bins[ix]
+        # packit() doesn't turn the packages around, it gets them turned the way they fit
+        todo = [PackageGroup(next(o for o in g.package.orientations() if o in bin), left[i])
+                for i, g in enumerate(self.groups) if left[i] and ix in self.fitting[i]]
+        content = packit(bin, todo)[0][0]
+        volume = sum(g.volume for g in content)
+        child = cost + (bin.volume - volume) / self.unit
+        if ix not in used:
+            child += self.fixed[ix]
+        after = self.take(left, content)
+        return child + self.bound(after, used | frozenset([ix])), child, ix, content, after
+
+    def bound(self, left, used):
+        """A lower bound on the cost of packing the counts in left into new bins."""
+        volume = 0
+        fixed = 0
+        smallest = 0
+        for i, n in enumerate(left):
+            if not n:
+                continue
+            volume += self.groups[i].package.volume * n
+            smallest = max(smallest, self.smallest[i])
+            if not used.intersection(self.fitting[i]):
+                # a bin of a type not used yet has to be added for these
+                fixed = max(fixed, min(self.fixed[ix] for ix in self.fitting[i]))
+        if not volume:
+            return 0
+        return fixed + (max(volume, smallest) - volume) / self.unit
+
+    def children(self, left, used, cost, strict=True):
+        """The bins which can be added to a node, the most promising first.
+
+        Raises Timeout when out of iterations or time, unless strict is False.
+        """
+        children = []
+        for ix in xrange(len(self.bins)):
+            known = (left, ix) in self.fills
+            content, after = self.fill(left, ix)
+            if not known:
+                self.tick(strict)
+            if not content:
+                continue
+            volume = sum(g.volume for g in content)
+            child = cost + (self.bins[ix].volume - volume) / self.unit
+            if ix not in used:
+                child += self.fixed[ix]
+            children.append((child + self.bound(after, used | frozenset([ix])), child,
+                             ix, content, after))
+        children.sort(key=lambda c: c[:2])
+        return children
+
+    def dive(self, left, used=frozenset(), cost=0, chosen=()):
+        """Takes the most promising bin until everything is packed, for a first solution.
+
+        It isn't stopped by the limits, so there always is a solution to return, but once out of
+        iterations or time it only takes greedy() bins.
+        """
+        while any(left):
+            if self.exhausted():
+                estimate, cost, ix, content, left = self.greedy(left, used, cost)
+            else:
+                children = self.children(left, used, cost, strict=False)
+                if not children:
+                    return
+                estimate, cost, ix, content, left = children[0]
+            used = used | frozenset([ix])
+            chosen += ((content, ix),)
+        self.best, self.best_cost = chosen, cost
+
+    def search(self, left, used=frozenset(), cost=0, chosen=()):
+        if not any(left):
+            if self.best_cost is None or cost < self.best_cost:
+                self.best, self.best_cost = chosen, cost
+            return
+        if self.best_cost is not None and cost + self.bound(left, used) >= self.best_cost:
+            return
+        # the same packages left with the same bins can only be worse if reached at a higher cost
+        key = (left, used)
+        if key in self.seen and self.seen[key] <= cost:
+            return
+        self.seen[key] = cost
+        for estimate, child, ix, content, after in self.children(left, used, cost):
+            if self.best_cost is not None and estimate >= self.best_cost:
+                # the children are sorted, none of the others can do better
+                break
+            self.search(after, used | frozenset([ix]), child, chosen + ((content, ix),))
+
+    def result(self):
+        """The best packing found, as binpack() returns it."""
+        packed = []
+        bybin = {}
+        for content, ix in self.best or ():
+            if ix not in bybin:
+                bybin[ix] = []
+                packed.append((bybin[ix], self.bins[ix]))
+            bybin[ix].append(content)
+        return packed
+
+
+def binpack(packages, bins=None, iterlimit=5000, deadline=None, stats=None, processes=0):
+    """Packs a list of Package() or PackageGroup() objects into a number of bins.
+
+    Returns a list of (bins, bin) listing the PackageGroups within each bin and a list of PackageGroups
+    which can't be packed because they are to big. iterlimit bounds how many times a bin is filled.
+    The search stops at the iteration limit or the deadline, returning the best solution found by
+    then. stats is filled in like binpack_simple.binpack() does, and with processes above 1 the
+    orientations tried to fill each bin are searched in a pool of that many processes, as there."""
+    if bins is None:
+        bins = [Package("600x400x400")]
+    elif isinstance(bins, Package):
+        bins = [bins]
+    start = time.time()
+    if stats is not None:
+        stats['cut_short'] = False
+    groups = sorted(group(packages), key=unit_volume, reverse=True)
+    bins = [bin for bin in bins if any(fits(g.package, bin) for g in groups)]
+    packable = [any(fits(g.package, bin) for bin in bins) for g in groups]
+    rest = [g for g, ok in zip(groups, packable) if not ok]
+    groups = [g for g, ok in zip(groups, packable) if ok]
+    packed = cheapest_single_box(groups, bins) if groups else None
+    if stats is not None:
+        stats['single_box'] = packed is not None
+    if packed is None:
+        packed = []
+    if not packed and groups:
+        state = BranchAndBound(groups, bins, iterlimit, deadline, processes)
+        left = tuple(g.count for g in groups)
+        state.dive(left)
+        try:
+            state.search(left)
+        except Timeout:
+            if stats is not None:
+                stats['cut_short'] = True
+        packed = state.result()
+    if stats is not None:
+        stats['elapsed'] = int((time.time() - start) * 1000)
+    return packed, rest
@@ -36,106 +36,170 @@ Created by Maximillian Dornseif on 2010-08-14.
 Copyright (c) 2010 HUDORA. All rights reserved.
 """
 
+from __future__ import division
 
+import multiprocessing
+from multiprocessing import TimeoutError
+import Queue
+import threading
 import time
-from itertools import permutations
+from math import ceil
+from functools import partial
+from itertools import islice, izip, permutations
 
 
-from package import Package
+from package import Package, PackageGroup, Shape, group
+from deadline import Deadline
 
 
+def unit_volume(g):
+    """Sort key for PackageGroups."""
+    return g.package.volume
 
-def packstrip(bin, p):
+
+def packstrip(bin, shapes, counts, live):
     """Creates a Strip which fits into bin.
 
-    Returns the Packages to be used in the strip, the dimensions of the strip as a 3-tuple
-    and a list of "left over" packages.
+    shapes is a list of package shapes sorted by volume, counts holds how many packages of each shape
+    are still to be packed and live links, in order, the indexes with packages left (see linked()).
+    The packages taken for the strip are subtracted from counts, and the indexes none are left of
+    unlinked from live. Returns the (index, count) pairs used in the strip and the dimensions of the
+    strip as a 3-tuple. As many packages of a shape as fit are stacked at once.
     """
     # This code is somewhat optimized and somewhat unreadable
     s = []                # strip
-    r = []                # rest
     ss = sw = sl = 0      # stripsize
     bs = bin.heigth       # binsize
+    room = bs             # left on top
     sapp = s.append       # speedup
-    rapp = r.append       # speedup
-    ppop = p.pop          # speedup
-    while p and (ss <= bs):
-        n = ppop(0)
-        nh, nw, nl = n.size
-        if ss + nh <= bs:
-            ss += nh
-            sapp(n)
+    nxt, prv = live
+    end = len(counts)
+    i = nxt[end]
+    while i != end:
+        shape = shapes[i]
+        nh = shape.heigth
+        if nh <= room:
+            left = counts[i]
+            fit = left if nh * left <= room else int(room // nh)
+            ss += nh * fit
+            room -= nh * fit
+            counts[i] = left - fit
+            if fit == left:
+                # i keeps its own links, for giveback() to put it back
+                nxt[prv[i]] = nxt[i]
+                prv[nxt[i]] = prv[i]
+            sapp((i, fit))
+            nw = shape.width
+            nl = shape.length
             if nw > sw:
                 sw = nw
             if nl > sl:
                 sl = nl
-        else:
-            rapp(n)
-    return s, (ss, sw, sl), r + p
+            if room <= 0:
+                # nothing else fits on top
+                break
+        i = nxt[i]
+    return s, (ss, sw, sl)
+
+
+def linked(count):
+    """The live links of packstrip() for count indexes: the next and previous live index of each,
+    with count standing for both ends of the list.
+
+    >>> linked(3)
+    ([1, 2, 3, 0], [3, 0, 1, 2])
+    """
+    return range(1, count + 1) + [0], [count] + range(count)
+
+
+def giveback(counts, taken, live):
+    """Returns the (index, count) pairs of a strip or layer which was not used to counts.
+
+    The indexes unlinked by packstrip() are linked back in the reverse order, which restores the
+    links as they were as long as the latest strip or layer is given back first.
+    """
+    nxt, prv = live
+    for i, n in reversed(taken):
+        if not counts[i]:
+            nxt[prv[i]] = i
+            prv[nxt[i]] = i
+        counts[i] += n
 
 
-def packlayer(bin, packages):
+def packlayer(bin, shapes, counts, live):
     strips = []
     layersize = 0
     layerx = 0
     layery = 0
     binsize = bin.width
-    while packages:
-        strip, (sizex, stripsize, sizez), rest = packstrip(bin, packages)
+    while True:
+        strip, (sizex, stripsize, sizez) = packstrip(bin, shapes, counts, live)
+        if not strip:
+            # we were not able to pack anything
+            break
         if layersize + stripsize <= binsize:
-            packages = rest
-            if not strip:
-                # we were not able to pack anything
-                break
             layersize += stripsize
             layerx = max([sizex, layerx])
             layery = max([sizez, layery])
             strips.extend(strip)
         else:
             # Next Layer please
-            packages = strip + rest
+            giveback(counts, strip, live)
             break
-    return strips, (layerx, layersize, layery), packages
+    return strips, (layerx, layersize, layery)
 
 
-def packbin(bin, packages):
-    packages.sort(reverse=True)
+def packbin(bin, shapes, counts, live):
     layers = []
     contentheigth = 0
     contentx = 0
     contenty = 0
     binsize = bin.length
-    while packages:
-        layer, (sizex, sizey, layersize), rest = packlayer(bin, packages)
+    while True:
+        layer, (sizex, sizey, layersize) = packlayer(bin, shapes, counts, live)
+        if not layer:
+            # we were not able to pack anything
+            break
         if contentheigth + layersize <= binsize:
-            packages = rest
-            if not layer:
-                # we were not able to pack anything
-                break
             contentheigth += layersize
             contentx = max([contentx, sizex])
             contenty = max([contenty, sizey])
             layers.extend(layer)
         else:
             # Next Bin please
-            packages = layer + rest
+            giveback(counts, layer, live)
             break
-    return layers, (contentx, contenty, contentheigth), packages
+    return layers, (contentx, contenty, contentheigth)
 
 
 def packit(bin, originalpackages):
+    """Packs the PackageGroups in originalpackages into as many bins as needed.
+
+    Returns the PackageGroups in each bin and the PackageGroups which don't fit into bin at all. The
+    groups are sorted once and then worked through by index over their remaining counts, so that
+    filling a strip never has to copy or shift the list of packages still to be packed, and only
+    looks at the groups which have packages left.
+    """
     packedbins = []
-    packages = sorted(originalpackages, reverse=True)
-    rest = packages
-    while packages:
-        packagesinbin, (binx, biny, binz), rest = packbin(bin, packages)
+    groups = sorted(originalpackages, key=unit_volume, reverse=True)
+    shapes = [g.package for g in groups]
+    counts = [g.count for g in groups]
+    live = linked(len(counts))
+    while live[0][-1] != len(counts):
+        packagesinbin, (binx, biny, binz) = packbin(bin, shapes, counts, live)
         if not packagesinbin:
             # we were not able to pack anything
             break
-        packedbins.append(packagesinbin)
-        packages = rest
-    # we now have a result, try to get a better result by rotating some bins
-
+        # a shape may have been used by several strips, keep a single group for it
+        inbin = {}
+        order = []
+        for i, n in packagesinbin:
+            if i not in inbin:
+                inbin[i] = 0
+                order.append(i)
+            inbin[i] += n
+        packedbins.append([PackageGroup(shapes[i], inbin[i]) for i in order])
+    rest = [PackageGroup(shapes[i], n) for i, n in enumerate(counts) if n]
     return packedbins, rest
 
 
@@ -143,53 +207,373 @@ class Timeout(Exception):
     pass
 
 
-def allpermutations_helper(permuted, todo, maxcounter, callback, bin, bestpack, counter):
+class Solved(Timeout):
+    """The search can stop because no better solution is possible."""
+    pass
+
+
+def compositions(total, parts):
+    """The ways of writing total as an ordered sum of parts positive integers.
+
+    >>> list(compositions(4, 2))
+    [(1, 3), (2, 2), (3, 1)]
+    """
+    if parts == 1:
+        yield (total,)
+        return
+    for first in xrange(1, total - parts + 2):
+        for rest in compositions(total - first, parts - 1):
+            yield (first,) + rest
+
+
+def orientation_splits(g, oriented, whole=False):
+    """The ways of turning the packages of the PackageGroup g, as tuples of PackageGroups.
+
+    oriented lists the orientations of g's package which fit in the bin. The packages of a group are
+    identical, so only how many of them are turned each way matters. Turning the whole group the
+    same way comes first, then splitting it between two orientations and so on; whole stops after
+    the first. packit() fills bins in the order of the groups, so each order of the orientations
+    is a split of its own.
+
+    >>> g = PackageGroup(Shape((30, 20, 10)), 2)
+    >>> oriented = [Shape((30, 20, 10), nosort=True), Shape((20, 30, 10), nosort=True)]
+    >>> for split in orientation_splits(g, oriented):
+    ...     print split
+    (<PackageGroup 2 x <Shape 30x20x10>>,)
+    (<PackageGroup 2 x <Shape 20x30x10>>,)
+    (<PackageGroup 1 x <Shape 30x20x10>>, <PackageGroup 1 x <Shape 20x30x10>>)
+    (<PackageGroup 1 x <Shape 20x30x10>>, <PackageGroup 1 x <Shape 30x20x10>>)
+    """
+    for parts in xrange(1, min(len(oriented), 1 if whole else g.count) + 1):
+        for chosen in permutations(oriented, parts):
+            for counts in compositions(g.count, parts):
+                yield tuple(PackageGroup(o, n) for o, n in izip(chosen, counts))
+
+
+def candidate_key(permuted):
+    """Identifies a candidate packing by how many packages of each group are turned which way."""
+    return tuple(tuple((g.package.size, g.count) for g in option) for option in permuted)
+
+
+def alone(package, bin):
+    """Whether packages turned like package are too big along every side of bin to share it."""
+    return 2 * package[0] > bin[0] and 2 * package[1] > bin[1] and 2 * package[2] > bin[2]
+
+
+def lower_bound(groups, bin):
+    """The least number of bins needed for the packages of groups which fit in bin.
+
+    It is the largest of the volume bound, the number of packages bigger than half the bin and
+    the number of packages which, however they are turned, can't share the bin with each other.
+
+    >>> lower_bound([PackageGroup(Package((60, 60, 60)), 3), PackageGroup(Package((10, 10, 10)))],
+    ...             Package((100, 100, 100)))
+    3
+    """
+    volume = 0
+    halves = 0
+    big = 0
+    for g in groups:
+        oriented = [o for o in g.package.orientations() if o in bin]
+        if not oriented:
+            # never packed
+            continue
+        volume += g.package.volume * g.count
+        if 2 * g.package.volume > bin.volume:
+            halves += g.count
+        if all(alone(o, bin) for o in oriented):
+            big += g.count
+    if not volume:
+        return 0
+    return max(int(ceil(volume / bin.volume)), halves, big)
+
+
+def best_complete(bestpack):
+    """Bins used by the best packing found which leaves nothing out, or None.
+
+    Searches running in the pool also see what the others published in their BOUNDS slot.
+    """
+    best = None if bestpack['rest'] else bestpack['bincount']
+    bins = published(bestpack)
+    if bins and (best is None or bins < best):
+        best = bins
+    return best
+
+
+def allpermutations_helper(permuted, todo, maxcounter, callback, bin, bestpack, counter,
+                           deadline=None, big=0):
+    """todo holds, for each group still to orient, a function returning its orientation splits.
+
+    Candidates which have been tried already (their keys are in bestpack['seen']) are skipped.
+    big counts the packages turned so far which can't share a bin; together with those in the
+    groups still to orient which can't share one however they are turned (bestpack['pending'])
+    it bounds the bins any candidate of this branch needs, so the branch is dropped when that
+    can't beat the best packing.
+    """
+    best = best_complete(bestpack)
+    if best is not None:
+        if best <= bestpack['bound']:
+            raise Solved('lower bound reached')
+        if big + bestpack['pending'][len(permuted)] >= best:
+            return counter
     if not todo:
-        return counter + callback(bin, permuted, bestpack)
+        key = candidate_key(permuted)
+        if key in bestpack['seen']:
+            return counter + 1
+        bestpack['seen'].add(key)
+        return counter + callback(bin, [g for option in permuted for g in option], bestpack)
     else:
         others = todo[1:]
-        thispackage = todo[0]
-        for dimensions in set(permutations((thispackage[0], thispackage[1], thispackage[2]))):
-            thispackage = Package(dimensions,
-                                  weight=thispackage.weight,
-                                  description=thispackage.description,
-                                  nosort=True)
-            if thispackage in bin:
-                counter = allpermutations_helper(permuted + [thispackage], others, maxcounter, callback,
-                                                 bin, bestpack, counter)
+        for option in todo[0]():
+            counter = allpermutations_helper(permuted + [option],
+                                             others, maxcounter, callback,
+                                             bin, bestpack, counter, deadline,
+                                             big + sum(g.count for g in option
+                                                       if alone(g.package, bin)))
             if counter > maxcounter:
                 raise Timeout('more than %d iterations tries' % counter)
+            if deadline is not None and deadline.expired():
+                raise Timeout('deadline reached after %d iterations' % counter)
         return counter
 
 
 def trypack(bin, packages, bestpack):
     bins, rest = packit(bin, packages)
-    if len(bins) < bestpack['bincount']:
+    # leaving fewer packages out is better than using fewer bins
+    left = sum(g.count for g in rest)
+    if (left, len(bins)) < (bestpack['left'], bestpack['bincount']):
+        bestpack['left'] = left
         bestpack['bincount'] = len(bins)
         bestpack['bins'] = bins
         bestpack['rest'] = rest
-    if bestpack['bincount'] < 2:
-        raise Timeout('optimal solution found')
+        if not rest:
+            publish(bestpack)
+    if not bestpack['rest'] and bestpack['bincount'] <= bestpack['bound']:
+        raise Solved('lower bound reached')
     return len(packages)
 
 
-def allpermutations(todo, bin, iterlimit=5000):
-    bestpack = dict(bincount=len(todo) + 1)
+def search_state(todo, bin, bound=1):
+    """The bestpack dict a search of the orientations of todo in bin works on."""
+    total = sum(g.count for g in todo)
+    # building each orientation only once
+    orientations = [[oriented for oriented in g.package.orientations() if oriented in bin]
+                    for g in todo]
+    # packages of the groups from each one on which can't share a bin however they are turned
+    pending = [0]
+    for g, oriented in reversed(zip(todo, orientations)):
+        always = oriented and all(alone(o, bin) for o in oriented)
+        pending.insert(0, pending[0] + (g.count if always else 0))
+    return dict(bincount=total + 1, left=total + 1, bins=[], rest=list(todo), seen=set(),
+                bound=bound, orientations=orientations, pending=pending)
+
+
+def search_orientations(todo, bin, iterlimit, deadline, bestpack, counter=0, stride=0, strides=1):
+    """Tries turning each group as a whole, and then splitting the groups between orientations.
+
+    Only one out of every strides ways of turning the first group is tried, starting with the
+    stride-th, so that strides searches can share the work.
+    """
+    def first(options):
+        return lambda: islice(options(), stride, None, strides)
+
+    for whole in (True, False):
+        if not whole and not any(g.count > 1 for g in todo):
+            break
+        splits = [partial(orientation_splits, g, oriented, whole)
+                  for g, oriented in izip(todo, bestpack['orientations'])]
+        if splits:
+            splits[0] = first(splits[0])
+        counter = allpermutations_helper([], splits, iterlimit, trypack, bin, bestpack,
+                                         counter, deadline)
+    return counter
+
+
+def allpermutations(todo, bin, iterlimit=5000, deadline=None, stats=None, bound=1, processes=0):
+    """Tries the orientations of the PackageGroups in todo, returning the best packing found.
+
+    The search stops as soon as a packing uses no more than bound bins. If the iteration limit or
+    the deadline stop it, stats['cut_short'] is set. With more than one process the orientations
+    are searched in the process pool.
+    """
+    bestpack = search_state(todo, bin, bound)
     try:
         # First try unpermuted
-        trypack(bin, todo, bestpack)
-        # now try permutations
-        allpermutations_helper([], todo, iterlimit, trypack, bin, bestpack, 0)
-    except Timeout, e:
+        bestpack['seen'].add(candidate_key([(g,) for g in todo]))
+        counter = trypack(bin, todo, bestpack)
+        if processes > 1 and len(todo) > 1:
+            cut_short = search_in_pool(todo, bin, iterlimit - counter, deadline, bestpack, processes)
+            if cut_short and stats is not None:
+                stats['cut_short'] = True
+        else:
+            search_orientations(todo, bin, iterlimit, deadline, bestpack, counter)
+    except Solved:
         pass
+    except Timeout:
+        if stats is not None:
+            stats['cut_short'] = True
     return bestpack['bins'], bestpack['rest']
 
+
+# Process pool for the orientation search. Every search running in it gets a slot of BOUNDS,
+#  where the bins used by the best complete packing found so far by any of its processes are
+#  published (0 while there is none), so that they all prune against it. A slot is the pair
+#  BOUNDS[2 * slot] (a generation, counting the searches which used the slot) and
+#  BOUNDS[2 * slot + 1] (the bins): processes of a search which gave up waiting for them keep
+#  running for a while, and only read or write the bins while the generation is still theirs.
+POOL_SLOTS = 64
+BOUNDS = None
+_pool = None
+_pool_size = 0
+# searches using each pool, a pool replaced by one of another size is terminated by the last one
+_pool_users = {}
+_pool_lock = threading.Lock()
+_free_slots = Queue.Queue()
+
+
+def _init_worker(bounds):
+    global BOUNDS
+    BOUNDS = bounds
+
+
+def get_pool(processes):
+    """The process pool, forked once and kept for the following searches.
+
+    Every call must be matched by a release_pool() once the search is done with the pool."""
+    global BOUNDS, _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != processes:
+            if _pool is not None and not _pool_users[_pool]:
+                del _pool_users[_pool]
+                _pool.terminate()
+            if BOUNDS is None:
+                BOUNDS = multiprocessing.Array('i', 2 * POOL_SLOTS)
+                for slot in range(POOL_SLOTS):
+                    _free_slots.put(slot)
+            _pool = multiprocessing.Pool(processes, _init_worker, (BOUNDS,))
+            _pool_size = processes
+            _pool_users[_pool] = 0
+        _pool_users[_pool] += 1
+        return _pool
+
+
+def release_pool(pool):
+    """Done with a pool from get_pool(), terminating it if it was replaced and no one else uses it."""
+    with _pool_lock:
+        _pool_users[pool] -= 1
+        if pool is not _pool and not _pool_users[pool]:
+            del _pool_users[pool]
+            pool.terminate()
+
+
+def take_slot(bincount):
+    """A free slot of BOUNDS for a new search, with its bins set to bincount, or None.
+
+    Returns the slot and its generation."""
+    try:
+        slot = _free_slots.get_nowait()
+    except Queue.Empty:
+        return None, None
+    with BOUNDS.get_lock():
+        generation = (BOUNDS[2 * slot] + 1) % 2 ** 31
+        BOUNDS[2 * slot] = generation
+        BOUNDS[2 * slot + 1] = bincount
+    return slot, generation
+
+
+def published(bestpack):
+    """The bins published in the slot of the search of bestpack, or 0."""
+    slot = bestpack.get('slot')
+    if slot is None:
+        return 0
+    bins = BOUNDS[2 * slot + 1]
+    # read after the bins, so that they can't be those of a later search
+    if BOUNDS[2 * slot] != bestpack['generation']:
+        return 0
+    return bins
+
+
+def publish(bestpack):
+    """Shares the bins used by the best complete packing with the other searches in the pool."""
+    slot = bestpack.get('slot')
+    if slot is None:
+        return
+    with BOUNDS.get_lock():
+        if BOUNDS[2 * slot] != bestpack['generation']:
+            # the search this was for is over
+            return
+        if not BOUNDS[2 * slot + 1] or bestpack['bincount'] < BOUNDS[2 * slot + 1]:
+            BOUNDS[2 * slot + 1] = bestpack['bincount']
+
+
+def search_stride(todo, bin, iterlimit, remaining, bound, slot, generation, stride, strides):
+    """Runs in the pool: searches a stride of the orientations of todo, see search_orientations.
+
+    Returns how many packages the best packing it found leaves out, its bins and rest, and whether
+    the search was cut short."""
+    deadline = Deadline(max(1, remaining * 1000)) if remaining is not None else None
+    bestpack = search_state(todo, bin, bound)
+    bestpack['slot'] = slot
+    bestpack['generation'] = generation
+    cut_short = False
+    try:
+        search_orientations(todo, bin, iterlimit, deadline, bestpack, 0, stride, strides)
+    except Solved:
+        pass
+    except Timeout:
+        cut_short = True
+    return bestpack['left'], bestpack['bins'], bestpack['rest'], cut_short
+
+
+def search_in_pool(todo, bin, iterlimit, deadline, bestpack, processes):
+    """Splits the search of the orientations of todo between processes, keeping the best packing
+    in bestpack. Returns whether any part of it was cut short."""
+    pool = get_pool(processes)
+    try:
+        slot, generation = take_slot(0 if bestpack['rest'] else bestpack['bincount'])
+        if slot is None:
+            # too many searches at the same time, do this one here
+            search_orientations(todo, bin, iterlimit, deadline, bestpack)
+            return False
+        try:
+            remaining = deadline.remaining() if deadline is not None else None
+            results = [pool.apply_async(search_stride,
+                                        (todo, bin, max(1, iterlimit // processes), remaining,
+                                         bestpack['bound'], slot, generation, stride, processes))
+                       for stride in range(processes)]
+            cut_short = False
+            for result in results:
+                try:
+                    # the searches stop by the deadline, give them a second to send their results
+                    left, bins, rest, cut = result.get(None if remaining is None
+                                                       else remaining + 1)
+                except TimeoutError:
+                    cut_short = True
+                    continue
+                cut_short = cut_short or cut
+                if (left, len(bins)) < (bestpack['left'], bestpack['bincount']):
+                    bestpack['left'] = left
+                    bestpack['bincount'] = len(bins)
+                    bestpack['bins'] = bins
+                    bestpack['rest'] = rest
+            return cut_short
+        finally:
+            # searches still running can't touch the slot once the next one bumps its generation
+            _free_slots.put(slot)
+    finally:
+        release_pool(pool)
+
+
 def packing_cost(packs, bin):
     """
     We will define the cost of a packing schema as the empty space in the boxes
+
+    It is computed in centimetres; bins with a `scale` attribute (like Shape, in millimetres) are
+    scaled down to them.
     """
-    dif = sum(bin.volume - sum(p.volume for p in pack) for pack in packs)
-    return bin.girth + dif + (1000 if bin[0] > 100 else 0)
+    scale = getattr(bin, 'scale', 1)
+    dif = sum(bin.volume - sum(p.volume for p in pack) for pack in packs) / scale ** 3
+    return bin.girth / scale + dif + (1000 if bin[0] > 100 * scale else 0)
 
 def sort_bins(bins, packages):
     """
@@ -199,9 +583,9 @@ def sort_bins(bins, packages):
     each = {}
     for bin in bins:
         each[bin] = 0
-        for package in packages:
-            if package in bin:
-                each[bin] += 1
+        for g in packages:
+            if g.package in bin:
+                each[bin] += g.count
     def bincmp(s, ot):
         c = cmp(each[s], each[ot])
         return c or cmp(ot.girth, s.girth)
@@ -209,11 +593,13 @@ def sort_bins(bins, packages):
     bins.sort(cmp=bincmp, reverse=True)
     return bins
 
-def iterate_permutations(original_packages, bins, iterlimit):
+def iterate_permutations(original_packages, bins, iterlimit, deadline=None, stats=None,
+                         processes=0):
     """Should not be used from without the library
 
     Iterates through single-sized bin package algorithms to return an
-    approximation to the best fit.
+    approximation to the best fit. Once the deadline is reached it returns the
+    best packing found so far.
     """
     if not bins:
         return [], original_packages
@@ -221,13 +607,20 @@ def iterate_permutations(original_packages, bins, iterlimit):
         return original_packages, []
     costs = []
     packlist = []
-    packages = sorted(original_packages, reverse=True)
+    packages = sorted(original_packages, key=unit_volume, reverse=True)
     bins = sort_bins(bins, packages)
     if not bins:
         return [], original_packages
 
     for ix, bin in enumerate(bins):
-        packs, rest = allpermutations(packages, bin, iterlimit)
+        if costs and deadline is not None and deadline.expired():
+            if stats is not None:
+                stats['cut_short'] = True
+            break
+        # no orientation can do with fewer bins than this
+        bound = lower_bound(packages, bin)
+        packs, rest = allpermutations(packages, bin, iterlimit, deadline, stats, bound,
+                                      processes)
         if not packs:
             continue
 
@@ -235,7 +628,8 @@ def iterate_permutations(original_packages, bins, iterlimit):
         newpacks = []
 
         if rest:
-            restpacks, rest = iterate_permutations(rest, bins[ix+1:], iterlimit)
+            restpacks, rest = iterate_permutations(rest, bins[ix+1:], iterlimit,
+                                                   deadline, stats, processes)
             if rest:
                 continue
             cost += sum(packing_cost(p, b) for p, b in restpacks)
@@ -274,16 +668,114 @@ def iterate_permutations(original_packages, bins, iterlimit):
         return [], rest
 
 
-def binpack(packages, bins=None, iterlimit=5000):
-    """Packs a list of Package() objects into a number of equal-sized bins.
+def fits(package, bin):
+    """Whether package fits in bin, turned some way."""
+    return any(oriented in bin for oriented in package.orientations())
 
-    Returns a list of bins listing the packages within the bins and a list of packages which can't be
-    packed because they are to big."""
+
+def single_box(groups, bins):
+    """A packing of groups into a single bin, the smallest one it's quickly found for, or None.
+
+    Bins are checked from the smallest one: their volume and dimensions first, then packit() with
+    every package turned standing as tall as it can, and then lying as flat as it can.
+    """
+    volume = sum(g.volume for g in groups)
+    dimensions = [sorted(g.package.size, reverse=True) for g in groups]
+    for bin in sorted(bins, key=lambda b: b.volume):
+        if bin.volume < volume:
+            continue
+        binsize = sorted(bin.size, reverse=True)
+        if not all(d[0] <= binsize[0] and d[1] <= binsize[1] and d[2] <= binsize[2]
+                   for d in dimensions):
+            continue
+        orientations = [[o for o in g.package.orientations() if o in bin] for g in groups]
+        for turn in (max, min):
+            candidate = [PackageGroup(turn(oriented, key=lambda o: o.size), g.count)
+                         for g, oriented in izip(groups, orientations)]
+            packs, rest = packit(bin, candidate)
+            if len(packs) == 1 and not rest:
+                return [(packs, bin)]
+    return None
+
+
+def cheapest_single_box(groups, bins):
+    """The packing single_box() finds, if no other packing can cost less, or None.
+
+    Any other packing uses some bin, paying at least the fixed cost (packing_cost() of an empty
+    pack) of the cheapest bin fitting a package, and either a bin holding the whole volume or at
+    least two bins fitting a package. Only when the single bin costs no more than that its packing
+    is taken without searching.
+
+    >>> small, big = Shape((300, 200, 100)), Shape((1000, 1000, 1000))
+    >>> cheapest_single_box([PackageGroup(Shape((300, 200, 100)), 1)], [big, small])[0][1]
+    <Shape 300x200x100>
+
+    Two of them only go together in the big bin, but two small bins cost less:
+
+    >>> single_box([PackageGroup(Shape((300, 200, 100)), 2)], [big, small])[0][1]
+    <Shape 1000x1000x1000>
+    >>> print cheapest_single_box([PackageGroup(Shape((300, 200, 100)), 2)], [big, small])
+    None
+    """
+    packed = single_box(groups, bins) if groups else None
+    if packed is None:
+        return None
+    fitting = [bin for bin in bins if any(fits(g.package, bin) for g in groups)]
+    volume = sum(g.volume for g in groups)
+    smallest = min(bin.volume for bin in fitting)
+    whole = min(bin.volume for bin in fitting if bin.volume >= volume)
+    unit = getattr(fitting[0], 'scale', 1) ** 3
+    bound = (min(packing_cost([], bin) for bin in fitting)
+             + max(0, min(whole, 2 * smallest) - volume) / unit)
+    packs, bin = packed[0]
+    if packing_cost(packs, bin) > bound:
+        return None
+    return packed
+
+
+def binpack(packages, bins=None, iterlimit=5000, deadline=None, stats=None, processes=0):
+    """Packs a list of Package() or PackageGroup() objects into a number of bins.
+
+    Returns a list of (bins, bin) listing the PackageGroups within each bin and a list of PackageGroups
+    which can't be packed because they are to big. The search stops at the deadline (anything with an
+    expired() method), returning the best solution found by then.
+
+    If a stats dict is given, it gets the milliseconds the search took as 'elapsed', whether it
+    was stopped by the deadline or the iteration limit before trying everything as 'cut_short' and
+    whether everything went in a single bin without searching (see cheapest_single_box()) as
+    'single_box'.
+
+    With processes above 1 the orientations are searched in a pool of that many processes, forked
+    the first time and kept for the following calls.
+
+    These only go in a single box with the second group split between orientations in the right
+    order:
+
+    >>> boxes = [Shape(size) for size in ((300, 200, 150), (400, 300, 200), (600, 400, 400),
+    ...                                   (250, 250, 250), (500, 300, 300))]
+    >>> packed, rest = binpack([PackageGroup(Shape((224, 27, 122)), 2),
+    ...                         PackageGroup(Shape((101, 56, 271)), 3)], boxes)
+    >>> [(len(packs), bin) for packs, bin in packed], rest
+    ([(1, <Shape 300x200x150>)], [])
+    """
     if bins is None:
         bins = [Package("600x400x400")]
     elif isinstance(bins, Package):
         bins = [bins]
-    return iterate_permutations(packages, bins, iterlimit)
+    start = time.time()
+    if stats is not None:
+        stats['cut_short'] = False
+    packages = group(packages)
+    res = cheapest_single_box(packages, bins)
+    if stats is not None:
+        stats['single_box'] = res is not None
+    if res is not None:
+        res = res, []
+    else:
+        res = iterate_permutations(packages, bins, iterlimit, deadline, stats, processes)
+    if stats is not None:
+        stats['elapsed'] = int((time.time() - start) * 1000)
+    return res
 
 
 def test():
@@ -303,3 +795,88 @@ def test():
             nachher += len(bins)
     print time.time() - start,
     print vorher, nachher, float(nachher) / vorher * 100
+
+
+def _packit_lists(bin, originalpackages):
+    """The original packit(), which packs a flat list of packages and builds a new list of those left
+    for every strip. Only kept for benchmark() to compare with."""
+
+    def packstrip(p):
+        s = []
+        r = []
+        ss = sw = sl = 0
+        bs = bin.heigth
+        while p and (ss <= bs):
+            n = p.pop(0)
+            nh, nw, nl = n.size
+            if ss + nh <= bs:
+                ss += nh
+                s.append(n)
+                sw = max(sw, nw)
+                sl = max(sl, nl)
+            else:
+                r.append(n)
+        return s, (ss, sw, sl), r + p
+
+    def packlayer(packages):
+        strips = []
+        layersize = layery = 0
+        while packages:
+            strip, (sizex, stripsize, sizez), rest = packstrip(packages)
+            if layersize + stripsize <= bin.width:
+                packages = rest
+                if not strip:
+                    break
+                layersize += stripsize
+                layery = max(layery, sizez)
+                strips.extend(strip)
+            else:
+                packages = strip + rest
+                break
+        return strips, layery, packages
+
+    def packbin(packages):
+        layers = []
+        contentheigth = 0
+        while packages:
+            layer, layersize, rest = packlayer(packages)
+            if contentheigth + layersize <= bin.length:
+                packages = rest
+                if not layer:
+                    break
+                contentheigth += layersize
+                layers.extend(layer)
+            else:
+                packages = layer + rest
+                break
+        return layers, packages
+
+    packedbins = []
+    packages = sorted((g.package for g in originalpackages for i in xrange(g.count)),
+                      key=lambda p: p.volume, reverse=True)
+    rest = packages
+    while packages:
+        packagesinbin, rest = packbin(packages)
+        if not packagesinbin:
+            break
+        packedbins.append(packagesinbin)
+        packages = rest
+    return packedbins, rest
+
+
+def benchmark(sizes=(10, 30, 100, 300, 1000), repeat=3, seed=42):
+    """Times packit() on random carts of distinct packages to show how it scales, next to the
+    original list based packit()."""
+    import random
+    random.seed(seed)
+    bin = Shape((600, 400, 400))
+    for size in sizes:
+        packages = group(Shape((random.randint(50, 300), random.randint(50, 300), random.randint(20, 200)))
+                         for i in range(size))
+        results = []
+        for pack in (packit, _packit_lists):
+            start = time.time()
+            for i in range(repeat):
+                bins, rest = pack(bin, packages)
+            results.extend([(time.time() - start) / repeat, len(bins)])
+        print "%5d packages %8.4fs %4d bins, originally %8.4fs %4d bins" % ((size,) + tuple(results))
@@ -0,0 +1,88 @@
+"""
+Circuit breaker for the calls to the Canada Post API.
+
+Its state is kept in the django cache so every worker process sees the same
+one. When too many calls fail or are too slow, the breaker opens and calls
+fail right away with CircuitOpenError instead of waiting on Canada Post.
+"""
+import logging
+import time
+from canada_post.errors import CanadaPostError
+from canada_post_dp_shipping.errors import CircuitOpenError
+from django.core.cache import cache
+from livesettings.functions import config_get_group
+
+log = logging.getLogger('canada_post_dp_shipping.utils.breaker')
+
+# seconds the failure rate is measured over
+WINDOW = 60
+# calls needed in WINDOW before the breaker can open
+MIN_CALLS = 10
+
+class CircuitBreaker(object):
+    def __init__(self, name):
+        self.name = name
+        self.open_key = u"{}-open".format(name)
+        self.probation_key = u"{}-probation".format(name)
+        self.calls_key = u"{}-calls".format(name)
+        self.failures_key = u"{}-failures".format(name)
+
+    def is_open(self):
+        return cache.get(self.open_key) is not None
+
+    def call(self, fun, *args, **kwargs):
+        """
+        Calls fun(*args, **kwargs) unless the breaker is open, and records
+        whether it failed. CanadaPostErrors are answers from Canada Post, so
+        they only count as failures if they took too long
+        """
+        if self.is_open():
+            raise CircuitOpenError(u"Not calling Canada Post, it has been "
+                                   u"failing lately")
+        start = time.time()
+        try:
+            ret = fun(*args, **kwargs)
+        except CanadaPostError:
+            self.record(time.time() - start)
+            raise
+        except Exception:
+            self.record(time.time() - start, failed=True)
+            raise
+        self.record(time.time() - start)
+        return ret
+
+    def record(self, lapse, failed=False):
+        settings = config_get_group('canada_post_dp_shipping')
+        failure_rate = settings.BREAKER_FAILURE_RATE.value
+        if not failure_rate:
+            return
+        latency = settings.BREAKER_LATENCY.value
+        failed = failed or bool(latency and lapse * 1000 > latency)
+
+        if failed and cache.get(self.probation_key) is not None:
+            # it just came back, and it's failing again
+            self.trip(settings)
+            return
+        calls = self.incr(self.calls_key)
+        failures = self.incr(self.failures_key) if failed else \
+            cache.get(self.failures_key, 0)
+        if calls >= MIN_CALLS and failures * 100 >= failure_rate * calls:
+            self.trip(settings)
+
+    def trip(self, settings):
+        cooldown = settings.BREAKER_COOLDOWN.value
+        log.warning("Opening %s for %d seconds", self.name, cooldown)
+        cache.set(self.open_key, True, cooldown)
+        cache.set(self.probation_key, True, cooldown * 2)
+        cache.delete_many([self.calls_key, self.failures_key])
+
+    def incr(self, key):
+        cache.add(key, 0, WINDOW)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # expired in between
+            cache.add(key, 1, WINDOW)
+            return 1
+
+breaker = CircuitBreaker('CP-breaker')
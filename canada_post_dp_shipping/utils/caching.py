@@ -0,0 +1,70 @@
+"""
+Helpers to use the django cache that is shared by every worker process
+"""
+import logging
+import time
+from django.core.cache import cache
+
+log = logging.getLogger('canada_post_dp_shipping.utils.caching')
+
+# how long can a lock be held, in case the holder died
+LOCK_TIMEOUT = 30
+# how long to wait for somebody else's result before computing it ourselves
+WAIT = 5
+# time between cache probes while waiting
+POLL = 0.05
+
+def single_flight(key, lookup, compute, lock_timeout=LOCK_TIMEOUT, wait=WAIT):
+    """
+    Coalesce the computation of a cached value across processes.
+
+    lookup() returns the cached value or None, compute() calculates, caches
+    and returns it. Only the process holding the "<key>-lock" cache key calls
+    compute(), the others wait up to `wait` seconds for its result to show up
+    through lookup(), and compute it themselves if it doesn't.
+    """
+    value = lookup()
+    if value is not None:
+        return value
+    lock_key = u"{}-lock".format(key)
+    if cache.add(lock_key, True, lock_timeout):
+        try:
+            return compute()
+        finally:
+            cache.delete(lock_key)
+
+    log.debug("waiting for %s", key)
+    give_up = time.time() + wait
+    while time.time() < give_up:
+        time.sleep(POLL)
+        value = lookup()
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            # the holder finished without a result (it failed)
+            break
+    log.debug("gave up waiting for %s", key)
+    return compute()
+
+def set_stale(key, value, soft_ttl, hard_ttl):
+    """
+    Cache value for hard_ttl seconds, remembering when it goes stale (after
+    soft_ttl seconds)
+    """
+    cache.set(key, (time.time() + soft_ttl, value), hard_ttl)
+
+def unwrap_stale(entry):
+    """
+    Takes an entry cached by set_stale and returns (value, is_stale).
+    Returns (None, False) for missing entries
+    """
+    if entry is None:
+        return None, False
+    fresh_until, value = entry
+    return value, time.time() > fresh_until
+
+def get_stale(key):
+    """
+    Returns (value, is_stale) for a key cached with set_stale
+    """
+    return unwrap_stale(cache.get(key))
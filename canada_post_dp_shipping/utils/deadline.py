@@ -0,0 +1,51 @@
+"""
+Time budget shared by the different steps of a computation
+"""
+import time
+
+class Deadline(object):
+    """
+    A point in time some work has to be done by. A Deadline without a budget
+    never expires
+
+    >>> Deadline().expired(), Deadline().remaining(), Deadline(0).remaining()
+    (False, None, None)
+    >>> deadline = Deadline(1)
+    >>> time.sleep(0.01)
+    >>> deadline.expired(), deadline.remaining()
+    (True, 0)
+
+    A step within a deadline gets the sooner of both:
+
+    >>> 0 < Deadline(60000).within(1000).remaining() <= 1
+    True
+    >>> 0 < Deadline(1000).within(60000).remaining() <= 1
+    True
+    >>> 0 < Deadline(1000).within(None).remaining() <= 1
+    True
+    >>> Deadline().within(None).remaining() is None
+    True
+    """
+    def __init__(self, ms=None):
+        self.at = time.time() + ms / 1000.0 if ms else None
+
+    def remaining(self):
+        """
+        Seconds left, or None if there's no limit
+        """
+        if self.at is None:
+            return None
+        return max(0, self.at - time.time())
+
+    def within(self, ms):
+        """
+        A Deadline for a step which can take ms milliseconds, but must still be
+        done by this deadline
+        """
+        deadline = Deadline(ms)
+        if self.at is not None and (deadline.at is None or self.at < deadline.at):
+            deadline.at = self.at
+        return deadline
+
+    def expired(self):
+        return self.at is not None and time.time() >= self.at
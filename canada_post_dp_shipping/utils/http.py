@@ -0,0 +1,106 @@
+"""
+Process-wide HTTP connection pool for the traffic with Canada Post, so the
+connections (and their TLS handshakes) are reused between calls
+"""
+import pkgutil
+import sys
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# number of hosts to keep connections to
+POOL_CONNECTIONS = 4
+# connections kept to each host when nobody asks for more
+POOL_MAXSIZE = 4
+
+_session = None
+_maxsize = 0
+_lock = threading.Lock()
+_pooled = set()
+
+def get_session(maxsize=POOL_MAXSIZE):
+    """
+    Returns the keep-alive requests.Session shared by the whole process,
+    keeping at least maxsize connections to each host: the number of calls
+    the caller makes at the same time. The pool grows to fit the largest
+    maxsize asked for
+    """
+    global _session, _maxsize
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update({
+                'Accept-Encoding': 'gzip, deflate',
+                'Connection': 'keep-alive',
+            })
+            _session = session
+        if maxsize > _maxsize:
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                  pool_maxsize=maxsize)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _maxsize = maxsize
+        return _session
+
+class PooledRequests(object):
+    """
+    Stands for the requests module within a library, sending its calls
+    through the shared session. Anything else (exceptions, status codes...)
+    is taken from requests
+    """
+    def request(self, method, url, **kwargs):
+        return get_session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def options(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('OPTIONS', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('PATCH', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+def pool_library(package):
+    """
+    Makes every module of package (a library calling requests.get(),
+    requests.post()... on its own) go through the shared session, by
+    importing them all and pointing their `requests` to a PooledRequests
+    """
+    with _lock:
+        if package in _pooled:
+            return
+        _pooled.add(package)
+    module = __import__(package, fromlist=['__name__'])
+    for loader, name, ispkg in pkgutil.walk_packages(module.__path__,
+                                                     package + '.'):
+        try:
+            __import__(name)
+        except ImportError:
+            # parts needing something not installed aren't used either
+            continue
+    pooled = PooledRequests()
+    for name, module in sys.modules.items():
+        if module is None:
+            continue
+        if name != package and not name.startswith(package + '.'):
+            continue
+        if getattr(module, 'requests', None) is requests:
+            module.requests = pooled
@@ -7,7 +7,8 @@ Created by Maximillian Dornseif on 2006-12-02.
 Copyright HUDORA GmbH 2006, 2007, 2010
 You might consider this BSD-Licensed.
 """
-from decimal import Decimal
+from decimal import Decimal, ROUND_CEILING
+from itertools import permutations
 
 import doctest
 import unittest
@@ -92,8 +93,12 @@ class Package(object):
         return self[0] >= other[0] and self[1] >= other[1] and self[2] >= other[2]
 
     def __hash__(self):
-        return (int(self.heigth) + (int(self.width) << 16) +
-                (int(self.length) << 32))
+        """Consistent with __eq__, so 10.5 and 10 don't collide.
+
+        >>> hash(Package((105, 10, 10))) == hash(Package((100, 10, 10)))
+        False
+        """
+        return hash((self.heigth, self.width, self.length))
 
     def __eq__(self, other):
         """Package objects are equal if they have exactly the same dimensions.
@@ -111,6 +116,15 @@ class Package(object):
         """Enables to sort by Volume."""
         return cmp(self.volume, other.volume)
 
+    def orientations(self):
+        """The different ways the package can be turned around.
+
+        >>> sorted(Package((1, 1, 2)).orientations(), key=lambda p: p.size)
+        [<Package 1x1x2>, <Package 1x2x1>, <Package 2x1x1>]
+        """
+        return [Package(dimensions, weight=self.weight, description=self.description, nosort=True)
+                for dimensions in set(permutations(self.size))]
+
     def __mul__(self, multiplicand):
         """Package can be multiplied with an integer. This results in the Package beeing
            stacked along the biggest side.
@@ -180,6 +194,222 @@ class Package(object):
         description = (" %s" % (self.description.encode('utf8'))) if self.description else ""
         return "<Package %s%s%s>" % (dimensions, weight, description)
 
+def _ceil(value):
+    return int(Decimal(str(value)).to_integral_value(ROUND_CEILING))
+
+
+class Shape(object):
+    """Compact package used within the packing engine.
+
+    Dimensions are integer millimetres and the weight is in integer grams, so comparing and hashing
+    are exact and cheap. Volume and girth are computed once. Use from_cm() and to_cm() to convert
+    from and to the centimetres and kilograms used by Canada Post and the Django models.
+
+    >>> Shape.from_cm(('10.5', 20, '5.25'), '1.2')
+    <Shape 200x105x53 1200>
+    >>> Shape.from_cm((10, 20, 5)).to_cm()
+    (Decimal('20'), Decimal('10'), Decimal('5'))
+    >>> Shape.from_cm((Decimal('30.0'), '20.00', 10)).to_cm() == Shape.from_cm((20, 30, 10)).to_cm()
+    True
+    >>> Shape((105, 10, 10)) == Shape((100, 10, 10))
+    False
+    """
+    __slots__ = ('heigth', 'width', 'length', 'size', 'volume', 'girth', 'weight', 'description')
+
+    # millimetres in the unit packing costs are computed in (centimetres)
+    scale = 10
+
+    def __init__(self, size, weight=0, description="", nosort=False):
+        if not nosort:
+            size = sorted(size, reverse=True)
+        self.heigth, self.width, self.length = size
+        self.size = (self.heigth, self.width, self.length)
+        self.volume = self.heigth * self.width * self.length
+        self.girth = 2 * sum(self.size) - max(self.size)
+        self.weight = weight
+        self.description = description
+
+    @classmethod
+    def from_cm(cls, size, weight=0, description=""):
+        """Shape for dimensions in centimetres and weight in kilograms, rounded up."""
+        return cls(tuple(_ceil(Decimal(str(d)) * 10) for d in size),
+                   _ceil(Decimal(str(weight)) * 1000), description)
+
+    def to_cm(self):
+        """The dimensions in centimetres."""
+        return tuple(Decimal(d) / 10 for d in self.size)
+
+    @property
+    def kilograms(self):
+        return Decimal(self.weight) / 1000
+
+    def orientations(self):
+        """The different ways the shape can be turned around."""
+        return [Shape(dimensions, self.weight, self.description, nosort=True)
+                for dimensions in set(permutations(self.size))]
+
+    def __mul__(self, multiplicand):
+        """Stacks multiplicand shapes on their smallest side, like Package.__mul__.
+
+        >>> Shape((400, 300, 600), 2) * 2
+        <Shape 600x600x400 4>
+        """
+        return Shape((self.heigth, self.width, self.length * multiplicand),
+                     self.weight * multiplicand, self.description)
+
+    def __getitem__(self, key):
+        return self.size[key]
+
+    def __contains__(self, other):
+        """Checks if other fits within self, as they are oriented."""
+        return self.heigth >= other[0] and self.width >= other[1] and self.length >= other[2]
+
+    def __hash__(self):
+        return hash(self.size)
+
+    def __eq__(self, other):
+        return self.size == other.size
+
+    def __ne__(self, other):
+        return self.size != other.size
+
+    def __unicode__(self):
+        dimensions = u"x".join(unicode(d) for d in self.to_cm())
+        weight = u" {}".format(self.kilograms) if self.weight else ""
+        description = u" {}".format(self.description) if self.description else ""
+        return u"%s%s%s" % (dimensions, weight, description)
+
+    def __str__(self):
+        return unicode(self).encode('utf8')
+
+    def __repr__(self):
+        weight = " %d" % self.weight if self.weight else ""
+        description = (" %s" % self.description.encode('utf8')) if self.description else ""
+        return "<Shape %dx%dx%d%s%s>" % (self.heigth, self.width, self.length, weight, description)
+
+
+class PackageGroup(object):
+    """A number of identical packages, handled as a whole while packing.
+
+    >>> PackageGroup(Package((300, 400, 500), 2), 3)
+    <PackageGroup 3 x <Package 500x400x300 2>>
+    >>> PackageGroup(Package((300, 400, 500), 2), 3).weight
+    6
+    """
+    __slots__ = ('package', 'count')
+
+    def __init__(self, package, count=1):
+        self.package = package
+        self.count = count
+
+    @property
+    def volume(self):
+        return self.package.volume * self.count
+
+    @property
+    def weight(self):
+        return self.package.weight * self.count
+
+    @property
+    def kilograms(self):
+        """Weight of a group of Shapes in kilograms."""
+        return self.package.kilograms * self.count
+
+    def expand(self):
+        """The individual packages in the group."""
+        return [self.package] * self.count
+
+    def __unicode__(self):
+        return u"%d x %s" % (self.count, unicode(self.package))
+
+    def __str__(self):
+        return "%d x %s" % (self.count, str(self.package))
+
+    def __repr__(self):
+        return "<PackageGroup %d x %r>" % (self.count, self.package)
+
+
+def group(packages):
+    """Wraps Package objects in PackageGroups, leaving PackageGroups as they are."""
+    return [p if isinstance(p, PackageGroup) else PackageGroup(p) for p in packages]
+
+
+def expand(groups):
+    """The individual packages in a list of PackageGroups.
+
+    >>> expand([PackageGroup(Package((1, 2, 3)), 2), PackageGroup(Package((4, 5, 6)))])
+    [<Package 3x2x1>, <Package 3x2x1>, <Package 6x5x4>]
+    """
+    return [package for g in groups for package in g.expand()]
+
+
+def identity(package):
+    """Tells apart the packages of different groups, however they are turned."""
+    return tuple(sorted(package.size)), package.weight, package.description
+
+
+def _fits(size, bins):
+    size = sorted(size, reverse=True)
+    for bin in bins:
+        binsize = sorted(bin.size, reverse=True)
+        if size[0] <= binsize[0] and size[1] <= binsize[1] and size[2] <= binsize[2]:
+            return True
+    return False
+
+
+def bundle(groups, bins, size):
+    """Stacks up to size identical packages on their smallest side (package * count), as long as the
+    stack fits in one of bins, so that there are less packages to pack.
+
+    Returns the new groups and a dict for unbundle() telling the package and count of each stack.
+
+    Packages of different groups aren't stacked together even if they have a side in common, as
+    Package.__add__ and buendelung() would: unbundle() gives back each stack as a single group, and
+    a parcel has to list the packages of every group it holds.
+
+    >>> groups, bundles = bundle([PackageGroup(Shape((100, 50, 20), 5), 7)], [Shape((100, 100, 50))], 4)
+    >>> groups
+    [<PackageGroup 1 x <Shape 100x80x50 20>>, <PackageGroup 1 x <Shape 100x60x50 15>>]
+    >>> unbundle(groups, bundles)
+    [<PackageGroup 4 x <Shape 100x50x20 5>>, <PackageGroup 3 x <Shape 100x50x20 5>>]
+    """
+    bundled = []
+    bundles = {}
+
+    def stack(package, count):
+        stacked = package * count
+        bundles[identity(stacked)] = (package, count)
+        return stacked
+
+    for g in groups:
+        count = 1
+        while count < min(size, g.count) and _fits((g.package * (count + 1)).size, bins):
+            count += 1
+        if count < 2:
+            bundled.append(g)
+            continue
+        stacks, left = divmod(g.count, count)
+        bundled.append(PackageGroup(stack(g.package, count), stacks))
+        if left > 1:
+            bundled.append(PackageGroup(stack(g.package, left), 1))
+        elif left:
+            bundled.append(PackageGroup(g.package, 1))
+    return bundled, bundles
+
+
+def unbundle(groups, bundles):
+    """The groups of the packages the stacks made by bundle() in groups are made of."""
+    unbundled = []
+    for g in groups:
+        unit = bundles.get(identity(g.package))
+        if unit is None:
+            unbundled.append(g)
+        else:
+            package, count = unit
+            unbundled.append(PackageGroup(package, g.count * count))
+    return unbundled
+
+
 def buendelung(kartons, maxweight=31000, maxgurtmass=3000):
     """Versucht Pakete so zu bündeln, so dass das Gurtmass nicht überschritten wird.
 
@@ -190,8 +420,6 @@ def buendelung(kartons, maxweight=31000, maxgurtmass=3000):
     >>> buendelung([Package((800, 310, 250)), Package((800, 310, 250)), Package((800, 310, 250)), Package((800, 310, 250)), Package((450, 290, 250)), Package((450, 290, 250))])
     (2, [<Package 800x750x310>, <Package 500x450x290>], [<Package 800x310x250>])
     """
-    kartons = list(kartons)
-
     def buendelung_moeglich(box_a, box_b):
         """Entscheide, ob eine Bündelung der beiden Kartons möglich ist.
 
@@ -212,16 +440,18 @@ def buendelung(kartons, maxweight=31000, maxgurtmass=3000):
         return True
 
     MAXKARTONSIMBUENDEL = 6
-    if not kartons:
-        return 0, [], kartons
+    kartons = iter(kartons)
+    try:
+        lastcarton = next(kartons)
+    except StopIteration:
+        return 0, [], []
     gebuendelt = []
     rest = []
-    lastcarton = kartons.pop(0)
     buendel = False
     buendelcounter = 0
     kartons_im_buendel = 1
-    while kartons:
-        currentcarton = kartons.pop(0)
+    # walked through once, in order
+    for currentcarton in kartons:
         # check if 2 dimensions fit and bundling is possible
         if currentcarton.hat_gleiche_seiten(lastcarton) and buendelung_moeglich(lastcarton, currentcarton):
             # new carton has the same size in two dimensions and the sum of both in the third
@@ -251,10 +481,11 @@ def pack_in_bins(kartons, versandkarton):
     """Implements Bin-Packing.
 
     You provide it with a bin size and a list of Package Objects to be bined. Returns a list of lists
-    representing the bins with the binned Packages and a list of Packages too big for binning.
+    representing the bins with the binned Packages and a list of Packages too big for binning. It
+    needs pyshipping, which the shipping module doesn't depend on, so the example isn't run.
 
     >>> pack_in_bins([Package('135x200x250'), Package('170x380x390'), Package('485x280x590'), Package('254x171x368'), Package('201x172x349'), Package('254x171x368')], \
-                     Package('600x400x400'))
+                     Package('600x400x400')) # doctest: +SKIP
     ([[<Package 250x200x135>, <Package 349x201x172>, <Package 368x254x171>], [<Package 368x254x171>, <Package 390x380x170>]], [<Package 590x485x280>])
     """
 
@@ -0,0 +1,119 @@
+"""
+Content-addressed cache representation of packing results.
+
+A packing only depends on the shapes being packed and on the available boxes,
+so it is keyed by the sorted multiset of shapes and the boxes, and stored as
+an assignment of shapes to boxes. Weights and descriptions are filled back in
+from the current cart when it's read.
+"""
+import hashlib
+from package import PackageGroup
+
+def number(value):
+    """
+    Exact, canonical text for a dimension: 10, 10.0 and 10.00 are all "10"
+
+    >>> from decimal import Decimal
+    >>> number(10), number(Decimal('10.0')), number('10.00'), number(Decimal('10.5'))
+    ('10', '10', '10', '10.5')
+    """
+    text = str(value)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text
+
+def shape_key(package):
+    """
+    The shape of a package, regardless of its orientation
+    """
+    return tuple(number(d) for d in sorted(package.size, reverse=True))
+
+def shapes(groups):
+    """
+    Sorted multiset of the shapes in a list of PackageGroups, as
+    ((shape, count), ...)
+    """
+    counts = {}
+    for g in groups:
+        key = shape_key(g.package)
+        counts[key] = counts.get(key, 0) + g.count
+    return tuple(sorted(counts.items()))
+
+def packing_key(groups, boxes, engine='simple'):
+    """
+    Cache key for packing groups into boxes with a packing engine. It doesn't
+    depend on the order of the groups nor on their weights and descriptions
+
+    >>> from decimal import Decimal
+    >>> from package import Package
+    >>> boxes = [Package((60, 40, 40))]
+    >>> a = [PackageGroup(Package((30, 20, 10), 2, 'a'), 2), PackageGroup(Package((5, 5, 5)))]
+    >>> b = [PackageGroup(Package((5, 5, 5), 1, 'b')),
+    ...      PackageGroup(Package((Decimal('10.0'), 30, 20)), 2)]
+    >>> packing_key(a, boxes) == packing_key(b, boxes)
+    True
+    >>> packing_key(a, boxes) == packing_key(a, boxes, 'bnb')
+    False
+    >>> packing_key(a, boxes) == packing_key(a, [Package((60, 40, 41))])
+    False
+    """
+    text = repr((shapes(groups), sorted(shape_key(box) for box in boxes)))
+    if engine != 'simple':
+        # keeps the keys of the packings made before there was a choice
+        text += engine
+    return 'CP-binpack-{}'.format(hashlib.sha1(text).hexdigest())
+
+def to_assignment(result):
+    """
+    Strips a binpack() result down to the shapes packed in each box:
+    ([(box_shape, [[(shape, count), ...], ...]), ...], [(shape, count), ...])
+
+    >>> from package import Shape
+    >>> box = Shape((600, 400, 400))
+    >>> packs = [[PackageGroup(Shape((300, 200, 100), 2000, 'a'), 2)]]
+    >>> assignment = to_assignment(([(packs, box)], [PackageGroup(Shape((700, 10, 10)))]))
+    >>> assignment
+    ([(('600', '400', '400'), [[(('300', '200', '100'), 2)]])], [(('700', '10', '10'), 1)])
+
+    from_assignment() fills the packages back in from the groups of a cart:
+
+    >>> groups = [PackageGroup(Shape((100, 300, 200), 1000, 'b'), 2),
+    ...           PackageGroup(Shape((700, 10, 10)))]
+    >>> from_assignment(assignment, groups, [box])
+    ([([[<PackageGroup 2 x <Shape 300x200x100 1000 b>>]], <Shape 600x400x400>)], [<PackageGroup 1 x <Shape 700x10x10>>])
+    """
+    packed, rest = result
+    return ([(shape_key(box), [[(shape_key(g.package), g.count) for g in pack]
+                               for pack in packs])
+             for packs, box in packed],
+            [(shape_key(g.package), g.count) for g in rest])
+
+def from_assignment(assignment, groups, boxes):
+    """
+    Rebuilds a binpack() result out of an assignment, taking the packages of
+    each shape from groups and the boxes from boxes
+    """
+    available = {}
+    for g in groups:
+        available.setdefault(shape_key(g.package), []).append(
+            [g.package, g.count])
+    boxes = dict((shape_key(box), box) for box in boxes)
+
+    def take(shape, count):
+        taken = []
+        for entry in available[shape]:
+            if not count:
+                break
+            package, left = entry
+            n = min(left, count)
+            if n:
+                taken.append(PackageGroup(package, n))
+                entry[1] -= n
+                count -= n
+        return taken
+
+    packed, rest = assignment
+    return ([([sum((take(shape, count) for shape, count in pack), [])
+               for pack in packs], boxes[box])
+             for box, packs in packed],
+            sum((take(shape, count) for shape, count in rest), []))
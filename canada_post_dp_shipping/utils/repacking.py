@@ -0,0 +1,167 @@
+"""
+Incremental packing of a cart which changed a little.
+
+A cart usually changes a line at a time, and repacking it from scratch for
+every shipping estimate costs as much as the first time. repack() starts from
+the packing of the previous contents of the cart instead (as stored by
+packing.to_assignment), takes out the packages that were removed and puts the
+added ones in the free space of its parcels, only packing from scratch those
+that don't fit anywhere.
+"""
+from binpack_simple import single_box
+from package import PackageGroup
+from packing import shape_key, shapes
+
+# carts which gained more packages than this are repacked from scratch
+MAX_ADDED = 20
+# and so are carts which were repacked this many times in a row
+MAX_REPACKS = 5
+
+def volume(shape):
+    a, b, c = shape
+    return float(a) * float(b) * float(c)
+
+def fill(parcels):
+    """
+    How full a list of [box, {shape: count}] parcels are on average
+    """
+    capacity = sum(volume(box) for box, contents in parcels)
+    if not capacity:
+        return 1
+    return sum(volume(shape) * count for box, contents in parcels
+               for shape, count in contents.items()) / capacity
+
+def to_parcels(packed):
+    """
+    The parcels of the packed part of an assignment, as [box, {shape: count}]
+    """
+    result = []
+    for box, packs in packed:
+        for pack in packs:
+            contents = {}
+            for shape, count in pack:
+                contents[shape] = contents.get(shape, 0) + count
+            result.append([box, contents])
+    return result
+
+def assignment_fill(assignment):
+    """
+    How full the parcels of an assignment are
+
+    >>> assignment_fill(([(('20', '10', '10'), [[(('10', '10', '10'), 1)]])], []))
+    0.5
+    """
+    return fill(to_parcels(assignment[0]))
+
+def repack(previous, groups, boxes, pack, min_fill, repacks=0):
+    """
+    The assignment for packing groups into boxes, made out of the previous
+    assignment, or None if the cart has to be repacked from scratch: because
+    too much changed, a box is gone, the previous assignment was itself
+    repacked MAX_REPACKS times since the last full packing, or the parcels
+    would be filled less than min_fill (a fraction of their volume, from the
+    assignment_fill() of the last full packing). pack(groups) packs the
+    packages that didn't fit in the previous parcels, as binpack() does
+
+    >>> from package import Shape
+    >>> from packing import to_assignment
+    >>> box = Shape((200, 100, 100))
+    >>> cube = Shape((100, 100, 100))
+    >>> full = to_assignment(([([[PackageGroup(cube, 2)]], box)], []))
+    >>> full_fill = assignment_fill(full)
+    >>> def pack(groups):
+    ...     return [([[g] for g in groups], box)], []
+    >>> repack(full, [PackageGroup(cube, 1)], [box], pack, 0.5 * full_fill)
+    ([(('200', '100', '100'), [[(('100', '100', '100'), 1)]])], [])
+
+    A third cube needs another box, filling them less than the full packing
+    did, and a cart repacked too many times is packed from scratch:
+
+    >>> print repack(full, [PackageGroup(cube, 3)], [box], pack, full_fill)
+    None
+    >>> print repack(full, [PackageGroup(cube, 2)], [box], pack, full_fill,
+    ...              repacks=MAX_REPACKS)
+    None
+    """
+    if repacks >= MAX_REPACKS:
+        return None
+    packed, rest = previous
+    boxes = dict((shape_key(box), box) for box in boxes)
+    packages = {}
+    for g in groups:
+        packages.setdefault(shape_key(g.package), g.package)
+    if any(box not in boxes for box, packs in packed):
+        return None
+    parcels = to_parcels(packed)
+    left_out = dict(rest)
+
+    current = dict(shapes(groups))
+    before = {}
+    for box, contents in parcels + [(None, left_out)]:
+        for shape, count in contents.items():
+            before[shape] = before.get(shape, 0) + count
+    added = dict((shape, count - before.get(shape, 0))
+                 for shape, count in current.items()
+                 if count > before.get(shape, 0))
+    if sum(added.values()) > MAX_ADDED:
+        return None
+
+    # removed packages are taken out of what was left out first, and then
+    #  out of the last parcels, which are usually the emptiest
+    for shape, count in before.items():
+        extra = count - current.get(shape, 0)
+        for box, contents in [(None, left_out)] + parcels[::-1]:
+            if extra <= 0:
+                break
+            n = min(extra, contents.get(shape, 0))
+            if n:
+                contents[shape] -= n
+                extra -= n
+                if not contents[shape]:
+                    del contents[shape]
+    parcels = [parcel for parcel in parcels if parcel[1]]
+
+    # added packages go one at a time in the first parcel they fit in
+    unplaced = []
+    for shape, count in added.items():
+        for i in xrange(count):
+            for box, contents in parcels:
+                contents[shape] = contents.get(shape, 0) + 1
+                if single_box([PackageGroup(packages[s], n)
+                               for s, n in contents.items()],
+                              [boxes[box]]) is not None:
+                    break
+                contents[shape] -= 1
+                if not contents[shape]:
+                    del contents[shape]
+            else:
+                unplaced.append(shape)
+
+    if unplaced:
+        counts = {}
+        for shape in unplaced:
+            counts[shape] = counts.get(shape, 0) + 1
+        new, new_rest = pack([PackageGroup(packages[shape], count)
+                              for shape, count in counts.items()])
+        for packs, box in new:
+            for content in packs:
+                contents = {}
+                for g in content:
+                    shape = shape_key(g.package)
+                    contents[shape] = contents.get(shape, 0) + g.count
+                parcels.append([shape_key(box), contents])
+        for g in new_rest:
+            shape = shape_key(g.package)
+            left_out[shape] = left_out.get(shape, 0) + g.count
+
+    if fill(parcels) < min_fill:
+        return None
+
+    assignment = []
+    bybox = {}
+    for box, contents in parcels:
+        if box not in bybox:
+            bybox[box] = []
+            assignment.append((box, bybox[box]))
+        bybox[box].append(sorted(contents.items()))
+    return assignment, sorted(left_out.items())
@@ -0,0 +1,188 @@
+"""
+Packing out of the web workers.
+
+The packing search is CPU bound, and holds a request thread and the GIL of the
+web worker for as long as it takes. The packing_worker management command runs
+a long lived process which packs instead, keeping the latest packings in memory
+and the PACKING_PROCESSES pool forked. Shipper.binpack() asks it through pack()
+over a local socket, and packs in process when it doesn't answer in time.
+"""
+from collections import OrderedDict
+import hashlib
+import logging
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import (Listener, answer_challenge,
+                                        deliver_challenge)
+import _multiprocessing
+import os
+import socket
+import struct
+import threading
+from django.conf import settings
+from canada_post_dp_shipping.errors import PackingWorkerError
+from canada_post_dp_shipping.utils import time_f
+from canada_post_dp_shipping.utils.deadline import Deadline
+from canada_post_dp_shipping.utils.packing import (packing_key, to_assignment,
+                                                   from_assignment)
+
+log = logging.getLogger('canada_post_dp_shipping.utils.worker')
+
+# how many packings the worker keeps in memory
+WARM_PACKINGS = 1000
+# connections waiting to be accepted by the worker
+BACKLOG = 64
+
+def authkey():
+    """
+    Shared secret of the worker and its clients, since requests are pickles
+    """
+    return hashlib.sha1('CP-packing-worker-' + settings.SECRET_KEY).digest()
+
+def parse_address(address):
+    """
+    "host:port" for a TCP socket, anything else is the path of a unix socket
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and not address.startswith('/'):
+        return (host, int(port))
+    return address
+
+def connect(address, timeout):
+    """
+    An authenticated connection to the worker at address. Connecting, and
+    every read and write on the connection after, fail with an
+    EnvironmentError if they take more than timeout seconds
+    """
+    address = parse_address(address)
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    sock = socket.socket(family)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        # the connection reads and writes the descriptor itself, so its
+        #  timeouts are left to the kernel
+        sock.settimeout(None)
+        seconds = int(timeout)
+        interval = struct.pack('ll', seconds, int((timeout - seconds) * 1e6))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, interval)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, interval)
+        conn = _multiprocessing.Connection(os.dup(sock.fileno()))
+    finally:
+        sock.close()
+    try:
+        answer_challenge(conn, authkey())
+        deliver_challenge(conn, authkey())
+    except:
+        conn.close()
+        raise
+    return conn
+
+def pack(address, timeout, engine, packages, boxes, iterlimit, deadline=None,
+         processes=0, stats=None):
+    """
+    Packs like binpack(packages, boxes, iterlimit, deadline, stats, processes)
+    with the given engine, in the worker listening at address. Raises
+    PackingWorkerError if it can't be reached or doesn't answer within timeout
+    seconds
+    """
+    try:
+        conn = connect(address, timeout)
+    except (EnvironmentError, EOFError, AuthenticationError), e:
+        raise PackingWorkerError(u"can't connect to {}: {}".format(address, e))
+    try:
+        remaining = deadline.remaining() if deadline is not None else None
+        conn.send((engine, packages, boxes, iterlimit, remaining, processes))
+        if not conn.poll(timeout):
+            raise PackingWorkerError(u"no answer in {}s".format(timeout))
+        status, answer, worker_stats = conn.recv()
+    except (EnvironmentError, EOFError), e:
+        raise PackingWorkerError(unicode(e))
+    finally:
+        conn.close()
+    if status != 'ok':
+        raise PackingWorkerError(answer)
+    if stats is not None:
+        stats.update(worker_stats)
+    try:
+        return from_assignment(answer, packages, boxes)
+    except KeyError, e:
+        raise PackingWorkerError(u"unknown shape {} in the answer".format(e))
+
+class PackingWorker(object):
+    """
+    Serves packings to pack() calls, each one in its own thread, which also
+    authenticates the client so a slow one doesn't hold the others. engines
+    maps the PACKING_ENGINE values to binpack functions
+    """
+    def __init__(self, address, engines):
+        self.address = parse_address(address)
+        self.engines = engines
+        self.warm = OrderedDict()
+        self.lock = threading.Lock()
+
+    def serve(self):
+        if isinstance(self.address, basestring) and \
+                os.path.exists(self.address):
+            # left behind by a previous worker
+            os.unlink(self.address)
+        listener = Listener(self.address, backlog=BACKLOG)
+        log.info('listening on %s', self.address)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except EnvironmentError, e:
+                    log.warning('failed to accept a connection: %s', e)
+                    continue
+                thread = threading.Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+
+    def handle(self, conn):
+        try:
+            deliver_challenge(conn, authkey())
+            answer_challenge(conn, authkey())
+        except (EnvironmentError, EOFError, AuthenticationError), e:
+            log.warning('refused a connection: %s', e)
+            conn.close()
+            return
+        try:
+            request = conn.recv()
+            conn.send(('ok',) + self.pack(*request))
+        except Exception, e:
+            log.exception('packing failed')
+            try:
+                conn.send(('error', repr(e), {}))
+            except (EnvironmentError, EOFError):
+                pass
+        finally:
+            conn.close()
+
+    def pack(self, engine, packages, boxes, iterlimit, remaining, processes):
+        """
+        The assignment of the packing, and its stats
+        """
+        key = packing_key(packages, boxes, engine)
+        with self.lock:
+            assignment = self.warm.pop(key, None)
+            if assignment is not None:
+                self.warm[key] = assignment
+                return assignment, dict(elapsed=0, cut_short=False,
+                                        expired=False)
+        if remaining is None:
+            deadline = Deadline()
+        else:
+            deadline = Deadline(max(1, remaining * 1000))
+        stats = {}
+        res = time_f(self.engines[engine], 'canada-post-dp-shipping.binpack',
+                     packages, boxes, iterlimit, deadline, stats, processes)
+        assignment = to_assignment(res)
+        stats['expired'] = deadline.expired()
+        if not stats['expired']:
+            with self.lock:
+                self.warm[key] = assignment
+                while len(self.warm) > WARM_PACKINGS:
+                    self.warm.popitem(last=False)
+        return assignment, stats